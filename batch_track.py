@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from frame_format import toUint8
+from recording import Recording
+from tracker import Tracker
+
+# Tracks every frame of a recording (see recording.py) offline. The frames
+# are split into ranges that worker processes read straight from the memory
+# mapped chunks, so the run scales with the cores instead of the frame rate.
+#
+#   python batch_track.py <recording> <poses.npz|poses.csv> [--workers N]
+#
+# The pose table has one row per instrument found in a frame and one row
+# with instrument -1 for frames without any:
+#   frame, seq, t, instrument, pos (3), dir (3), rms, markers
+# where markers is the number of triangulated points in the frame.
+
+COLUMNS = ["frame", "seq", "t", "instrument", "pos", "dir", "rms", "markers"]
+
+_tracker = None
+
+
+def _workerTracker():
+    # one tracker per worker process, reused for all its ranges
+    global _tracker
+    if _tracker is None:
+        _tracker = Tracker(pool="none")
+    return _tracker
+
+
+def trackRange(path, start, stop):
+    """Pose table columns for frames start to stop of a recording."""
+    recording = Recording(path)
+    tracker = _workerTracker()
+    tracker.fitCamera(recording.width, recording.height)
+    # region of interest tracking starts over in every range
+    tracker.roiCircles = None
+    names = [model.name for model in tracker.registry.models]
+    bottomUp = recording.origin == "bottom-left"
+
+    rows = {name: [] for name in COLUMNS}
+
+    def addRow(i, header, instrument, pos, dir, rms, markers):
+        rows["frame"].append(i)
+        rows["seq"].append(header.seq)
+        rows["t"].append(header.timestamp)
+        rows["instrument"].append(instrument)
+        rows["pos"].append(pos)
+        rows["dir"].append(dir)
+        rows["rms"].append(rms)
+        rows["markers"].append(markers)
+
+    for i, (header, frame) in enumerate(recording.frames(start, stop), start):
+        points = tracker.findPoints(toUint8(frame), bottomUp)
+        found = tracker.registry.identify(points)
+        for pose in found:
+            addRow(
+                i,
+                header,
+                names.index(pose.name),
+                pose.pos,
+                pose.dir,
+                pose.rmsError,
+                len(points),
+            )
+        if not found:
+            addRow(i, header, -1, [np.nan] * 3, [np.nan] * 3, np.nan, len(points))
+
+    return {
+        "frame": np.array(rows["frame"], dtype=np.int64),
+        "seq": np.array(rows["seq"], dtype=np.int64),
+        "t": np.array(rows["t"], dtype=np.float64),
+        "instrument": np.array(rows["instrument"], dtype=np.int16),
+        "pos": np.array(rows["pos"], dtype=np.float64).reshape(-1, 3),
+        "dir": np.array(rows["dir"], dtype=np.float64).reshape(-1, 3),
+        "rms": np.array(rows["rms"], dtype=np.float64),
+        "markers": np.array(rows["markers"], dtype=np.int32),
+    }
+
+
+def trackRecording(path, workers=None, chunk=None):
+    """Pose table of a whole recording as a dict of column arrays."""
+    recording = Recording(path)
+    # ranges follow the chunk files, so each worker maps few of them
+    chunk = chunk or recording.chunkFrames
+    ranges = [
+        (s, min(s + chunk, len(recording))) for s in range(0, len(recording), chunk)
+    ]
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(trackRange, path, s, e) for s, e in ranges]
+        parts = [f.result() for f in futures]
+
+    if not parts:
+        parts = [trackRange(path, 0, 0)]
+    return {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+
+
+def saveTable(table, out, names):
+    if os.path.splitext(out)[1] == ".csv":
+        with open(out, "w") as file:
+            file.write("frame,seq,t,instrument,x,y,z,dx,dy,dz,rms,markers\n")
+            for r in range(len(table["frame"])):
+                instrument = table["instrument"][r]
+                values = [
+                    table["frame"][r],
+                    table["seq"][r],
+                    "{:.6f}".format(table["t"][r]),
+                    names[instrument] if instrument >= 0 else "",
+                ]
+                values += [
+                    "{:.6f}".format(v)
+                    for v in [*table["pos"][r], *table["dir"][r], table["rms"][r]]
+                ]
+                values.append(table["markers"][r])
+                file.write(",".join(str(v) for v in values) + "\n")
+    else:
+        np.savez(out, instruments=np.array(names), **table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track a recording offline")
+    parser.add_argument("recording")
+    parser.add_argument("out", help="pose table, .npz or .csv")
+    parser.add_argument("--workers", type=int, help="default: all cores")
+    parser.add_argument("--chunk", type=int, help="frames per task")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = trackRecording(args.recording, args.workers, args.chunk)
+    elapsed = time.perf_counter() - start
+
+    names = [model.name for model in _workerTracker().registry.models]
+    saveTable(table, args.out, names)
+
+    frames = len(np.unique(table["frame"]))
+    tracked = len(np.unique(table["frame"][table["instrument"] >= 0]))
+    print(
+        "{} frames in {:.1f} s ({:.0f} frames/s), instruments in {}".format(
+            frames, elapsed, frames / elapsed if elapsed else 0.0, tracked
+        )
+    )
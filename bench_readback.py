@@ -0,0 +1,56 @@
+import sys
+import time
+import threading
+import OpenGL.GL as gl
+import glfw
+from main_virtualcam import App
+from frame_stream import FrameStreamClient
+
+# Compares frames/sec of the synchronous and the PBO readback paths of
+# main_virtualcam.py, rendering only the gleon framebuffer.
+#
+#   python bench_readback.py [frames]
+
+frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+app = App()
+
+
+# stands in for a tracker that keeps up with every frame
+def drain():
+    client = FrameStreamClient()
+    while True:
+        client.recvFrame()
+
+
+threading.Thread(target=drain, daemon=True).start()
+while not app.stream.hasSubscribers():
+    time.sleep(0.01)
+
+print(
+    "framebuffer {}x{}, format {}".format(
+        app.fb_width, app.fb_height, app.stream.format.name
+    )
+)
+
+for mode in ["sync", "pbo"]:
+    app.readbackMode = mode
+    for _ in range(10):
+        app.drawGleonsStereo()
+    gl.glFinish()
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        app.drawGleonsStereo()
+        glfw.poll_events()
+    gl.glFinish()
+    elapsed = time.perf_counter() - start
+
+    print(
+        "{:5s} {:8.1f} fps {:8.3f} ms/frame".format(
+            mode, frames / elapsed, 1000 * elapsed / frames
+        )
+    )
+
+app.stream.close()
+glfw.terminate()
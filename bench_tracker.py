@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import camera_model
+import instrumentation
+from instruments import InstrumentModel, InstrumentRegistry
+from frame_format import toUint8
+from recording import Recording
+from synthetic import SyntheticStereo, trajectory, ringMarkers
+from tracker import Tracker
+
+# Throughput, per stage timings and accuracy of the tracker, on synthetic
+# frames over a grid of FB_ZOOM, marker counts and pixel noise, or on a
+# recording (with truth.npz when it was made by synthetic.py).
+#
+#   python bench_tracker.py [--frames N] [--json out.json]
+#   python bench_tracker.py --recording <dir> [--json out.json]
+
+STAGES = ["convert", "detect", "match", "triangulate", "identify"]
+
+instrumentation.enabled = True
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "max": values.max()}
+
+
+def run(tracker, frames, truth=None, bottomUp=True):
+    """Tracks frames, an iterable of frames as they are on the stream, truth is
+    (pos, dir) arrays."""
+    instrumentation.reset()
+    totals, posErrors, dirErrors = [], [], []
+    found = 0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        # float recordings are converted as the live tracker does
+        with instrumentation.span("convert"):
+            frame = toUint8(frame)
+        points = tracker.findPoints(frame, bottomUp)
+        with instrumentation.span("identify"):
+            poses = tracker.registry.identify(points)
+        totals.append(time.perf_counter() - start)
+
+        if not poses:
+            continue
+        found += 1
+        if truth is not None:
+            pos, dir = truth[0][i], truth[1][i]
+            posErrors.append(np.linalg.norm(poses[0].pos - pos))
+            dirErrors.append(np.degrees(np.arccos(np.clip(poses[0].dir @ dir, -1, 1))))
+
+    stages = instrumentation.summary()
+    result = {
+        "frames": len(totals),
+        "found": found,
+        "fps": len(totals) / sum(totals),
+        "total_ms": percentiles(np.array(totals) * 1000),
+        "stages_ms": {
+            name: dict(zip(["p50", "p95", "p99"], stages[name][1:]))
+            for name in STAGES
+            if name in stages
+        },
+    }
+    if truth is not None:
+        result["pos_error_mm"] = percentiles(np.array(posErrors) * 1000)
+        result["dir_error_deg"] = percentiles(dirErrors)
+    return result
+
+
+def synthetic(fbZoom, markers, noise, count, batch=60):
+    camera = camera_model.StereoCameraModel(fbZoom)
+    if markers == 3:
+        model = InstrumentModel("instrument1", "./assets/instrument1.obj")
+    else:
+        model = InstrumentModel("ring", None, markers=ringMarkers(markers))
+    generator = SyntheticStereo(camera, model.markers)
+    tracker = Tracker(camera=camera, registry=InstrumentRegistry([model]), pool="none")
+
+    pos, rot = trajectory(np.arange(count) / 60)
+    rng = np.random.default_rng(0)
+
+    def frames():
+        # rendered in batches, outside of the timed calls
+        for start in range(0, count, batch):
+            yield from generator.render(
+                pos[start : start + batch], rot[start : start + batch], noise, rng
+            )
+
+    result = run(tracker, frames(), (pos, rot @ model.axis))
+    tracker.close()
+    return result
+
+
+def recorded(path):
+    recording = Recording(path)
+    tracker = Tracker(pool="none")
+    tracker.fitCamera(recording.width, recording.height)
+    truth = None
+    truthPath = os.path.join(path, "truth.npz")
+    if os.path.exists(truthPath):
+        data = np.load(truthPath)
+        truth = data["pos"], data["dir"]
+    frames = (recording.frame(i) for i in range(len(recording)))
+    result = run(tracker, frames, truth, recording.origin == "bottom-left")
+    tracker.close()
+    return result
+
+
+def describe(config, result):
+    line = "{:34s} {:7.1f} fps  total p50 {:6.2f} p99 {:6.2f} ms  found {}/{}".format(
+        config,
+        result["fps"],
+        result["total_ms"]["p50"],
+        result["total_ms"]["p99"],
+        result["found"],
+        result["frames"],
+    )
+    if result.get("pos_error_mm"):
+        line += "  err {:.3f} mm {:.3f} deg".format(
+            result["pos_error_mm"]["p50"], result["dir_error_deg"]["p50"]
+        )
+    print(line)
+    print(
+        "    "
+        + "  ".join(
+            "{} {:.2f}".format(name, stage["p50"])
+            for name, stage in result["stages_ms"].items()
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tracker")
+    parser.add_argument("--frames", type=int, default=120, help="per configuration")
+    parser.add_argument("--zoom", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--markers", type=int, nargs="+", default=[3, 6, 12])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0, 4, 16])
+    parser.add_argument("--recording", help="benchmark a recording instead")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    results = []
+    if args.recording:
+        result = recorded(args.recording)
+        describe(args.recording, result)
+        results.append(dict(recording=args.recording, **result))
+    else:
+        for fbZoom in args.zoom:
+            for markers in args.markers:
+                for noise in args.noise:
+                    result = synthetic(fbZoom, markers, noise, args.frames)
+                    describe(
+                        "zoom {} markers {:2d} noise {:4.1f}".format(
+                            fbZoom, markers, noise
+                        ),
+                        result,
+                    )
+                    results.append(
+                        dict(fbZoom=fbZoom, markers=markers, noise=noise, **result)
+                    )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=1, default=float)
@@ -0,0 +1,94 @@
+import sys
+import time
+import glm
+import numpy as np
+import camera_model
+from utils import centroid, dist2
+from triangulation import triangulate, instrumentPose
+
+# Compares the per-frame glm triangulation loop the tracker used to run with
+# triangulation.py, one frame at a time as the live tracker calls it (the
+# scalar path for few markers) and over a stack of frames.
+#
+#   python bench_triangulation.py [frames]
+
+frames = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+camera = camera_model.default
+
+
+def legacyTriangulate(circlesL, circlesR):
+    points = []
+    for pL, pR in zip(circlesL, circlesR):
+        xDiff = abs(pL[0] - pR[0])
+        x = camera.camXDelta * (pL[0] + pR[0]) / (2 * xDiff)
+        y = camera.camXDelta * (pL[1]) / xDiff
+        z = camera.camXDelta * camera.focalLength / xDiff
+
+        vec = glm.vec4(x, y, z, 0)
+        vec = camera.camRotMat * vec
+        points.append((vec.x, vec.y + camera.camY, vec.z + camera.camZ))
+    return points
+
+
+def legacyPose(points):
+    c = centroid(points)
+    dists = [dist2(p, c) for p in points]
+    points_dists = list(zip(points, dists))
+    points_dists.sort(key=lambda pt_dist: pt_dist[1])
+    top, _ = points_dists[0]
+    m = centroid([points_dists[1][0], points_dists[2][0]])
+    instrDir = glm.normalize(glm.vec3(*top) - glm.vec3(*m))
+    return glm.vec3(*c), instrDir
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+rng = np.random.default_rng(0)
+ptsL = rng.uniform(-100, 100, size=(frames, 3, 2))
+ptsR = ptsL.copy()
+ptsR[..., 0] -= rng.uniform(20, 80, size=(frames, 3))
+
+legacyResult, legacyTime = timed(
+    lambda: [legacyPose(legacyTriangulate(ptsL[i], ptsR[i])) for i in range(frames)],
+    frames,
+)
+_, perFrameTime = timed(
+    lambda: [
+        instrumentPose(triangulate(camera, ptsL[i], ptsR[i])) for i in range(frames)
+    ],
+    frames,
+)
+stacked, stackedTime = timed(
+    lambda: instrumentPose(triangulate(camera, ptsL, ptsR)), frames
+)
+
+print("3 markers, {} frames".format(frames))
+print("  legacy    {:8.2f} us/frame".format(1e6 * legacyTime))
+print("  per frame {:8.2f} us/frame".format(1e6 * perFrameTime))
+print("  stacked   {:8.2f} us/frame".format(1e6 * stackedTime))
+
+# the legacy loop left world x mirrored
+mirror = np.array([-1.0, 1.0, 1.0])
+legacyPos = np.array([list(p) for p, _ in legacyResult]) * mirror
+legacyDir = np.array([list(d) for _, d in legacyResult]) * mirror
+print(
+    "  max difference to legacy: pos {:.2e} dir {:.2e}".format(
+        np.abs(stacked[0] - legacyPos).max(), np.abs(stacked[1] - legacyDir).max()
+    )
+)
+
+# triangulation alone for larger marker sets, one frame at a time
+for markers in [3, 12, 48]:
+    L = rng.uniform(-100, 100, size=(markers, 2))
+    R = L - [40, 0]
+    _, legacyTime = timed(lambda: [legacyTriangulate(L, R) for _ in range(1000)], 1000)
+    _, numpyTime = timed(lambda: [triangulate(camera, L, R) for _ in range(1000)], 1000)
+    print(
+        "{:3d} markers: legacy {:8.2f} us per frame {:8.2f} us".format(
+            markers, 1e6 * legacyTime, 1e6 * numpyTime
+        )
+    )
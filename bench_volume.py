@@ -0,0 +1,170 @@
+import argparse
+import json
+import time
+import numpy as np
+import OpenGL.GL as gl
+import glfw
+import params
+from volume_format import (
+    VolumeFormat,
+    chooseFormat,
+    packVolume,
+    textureBytes,
+    volumeShape,
+)
+
+# Upload time and VRAM of CT volume textures on synthetic int16 volumes of
+# awkward sizes, for the old layout (padded to powers of two, GL_RGBA32F),
+# padded with the compact format and at the exact size with it.
+#
+#   python bench_volume.py [--sizes 512x512x513 ...] [--repeat N] [--json out]
+#
+# VRAM is measured with GL_NVX_gpu_memory_info or GL_ATI_meminfo where the
+# driver has them, the estimate is texels times bytes per texel.
+
+# the old GL_RGBA32F layout, four float channels per texel
+RGBA32F = VolumeFormat("rgba32f", np.dtype(np.float32), gl.GL_RGBA32F, gl.GL_FLOAT, 1)
+
+CONFIGS = [("old", True, RGBA32F), ("padded", True, None), ("exact", False, None)]
+
+GPU_MEMORY_INFO_CURRENT_AVAILABLE_VIDMEM_NVX = 0x9049
+TEXTURE_FREE_MEMORY_ATI = 0x87FC
+
+
+def freeVideoMemoryKB():
+    extensions = {
+        gl.glGetStringi(gl.GL_EXTENSIONS, i).decode()
+        for i in range(gl.glGetIntegerv(gl.GL_NUM_EXTENSIONS))
+    }
+    if "GL_NVX_gpu_memory_info" in extensions:
+        return int(gl.glGetIntegerv(GPU_MEMORY_INFO_CURRENT_AVAILABLE_VIDMEM_NVX))
+    if "GL_ATI_meminfo" in extensions:
+        return int(np.ravel(gl.glGetIntegerv(TEXTURE_FREE_MEMORY_ATI))[0])
+    return None
+
+
+def syntheticCT(dims, rng):
+    # air around a water cylinder with bone noise, the content doesn't change
+    # the upload but keeps the range realistic
+    x, y = np.ogrid[-1 : 1 : dims[0] * 1j, -1 : 1 : dims[1] * 1j]
+    inside = (x**2 + y**2 < 0.8)[:, :, None]
+    ct = np.where(inside, 0, -1000).astype(np.int16)
+    ct = np.broadcast_to(ct, dims).copy(order="F")
+    ct += rng.integers(0, 3000, size=dims, dtype=np.int16) // 64
+    ct[dims[0] // 2, dims[1] // 2, :] = 3071
+    return ct
+
+
+def upload(tex, fmt, shape):
+    texo = gl.glGenTextures(1)
+    gl.glBindTexture(gl.GL_TEXTURE_3D, texo)
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+    gl.glFinish()
+    start = time.perf_counter()
+    gl.glTexImage3D(
+        gl.GL_TEXTURE_3D,
+        0,
+        fmt.internalFormat,
+        *shape,
+        0,
+        gl.GL_RED,
+        fmt.glType,
+        tex.ravel(order="F"),
+    )
+    gl.glFinish()
+    elapsed = time.perf_counter() - start
+    error = gl.glGetError()
+    gl.glBindTexture(gl.GL_TEXTURE_3D, 0)
+    return texo, elapsed, error
+
+
+def bench(raw, padding, fmt, repeat):
+    params.VOLUME_POT_PADDING = padding
+    shape = volumeShape(raw.shape)
+
+    start = time.perf_counter()
+    if fmt is None:
+        fmt, offset = chooseFormat(raw.dtype, raw.min(), raw.max())
+    else:
+        offset = 0
+    tex = packVolume(raw, shape, fmt, offset)
+    pack = time.perf_counter() - start
+
+    times, measured = [], None
+    for _ in range(repeat):
+        free = freeVideoMemoryKB()
+        texo, elapsed, error = upload(tex, fmt, shape)
+        if error != gl.GL_NO_ERROR:
+            gl.glDeleteTextures([texo])
+            return dict(shape=shape, format=fmt.name, error=int(error))
+        times.append(elapsed)
+        after = freeVideoMemoryKB()
+        if free is not None and after is not None:
+            measured = (free - after) / 1024
+        gl.glDeleteTextures([texo])
+
+    channels = 4 if fmt is RGBA32F else 1
+    return dict(
+        shape=shape,
+        format=fmt.name,
+        host_mb=tex.nbytes / 2**20,
+        vram_mb=textureBytes(fmt, shape) * channels / 2**20,
+        vram_measured_mb=measured,
+        pack_ms=pack * 1000,
+        upload_ms=float(np.median(times)) * 1000,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark volume uploads")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["181x217x181", "257x257x257", "300x300x97", "512x512x513"],
+        help="XxYxZ",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    glfw.init()
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    window = glfw.create_window(64, 64, "bench_volume", None, None)
+    glfw.make_context_current(window)
+    print(gl.glGetString(gl.GL_RENDERER).decode())
+
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        dims = tuple(int(n) for n in size.split("x"))
+        raw = syntheticCT(dims, rng)
+        for name, padding, fmt in CONFIGS:
+            result = bench(raw, padding, fmt, args.repeat)
+            result.update(size=size, config=name)
+            results.append(result)
+            if "error" in result:
+                print(
+                    "{:12s} {:7s} {:9s} GL error 0x{:x}".format(
+                        size, name, result["format"], result["error"]
+                    )
+                )
+                continue
+            measured = result["vram_measured_mb"]
+            print(
+                "{:12s} {:7s} {:9s} {:15s} VRAM {:8.1f} MB (measured {}) "
+                "pack {:7.1f} ms upload {:7.1f} ms".format(
+                    size,
+                    name,
+                    result["format"],
+                    "x".join(str(n) for n in result["shape"]),
+                    result["vram_mb"],
+                    "n/a" if measured is None else "{:.1f} MB".format(measured),
+                    result["pack_ms"],
+                    result["upload_ms"],
+                )
+            )
+
+    glfw.terminate()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=1)
@@ -0,0 +1,38 @@
+import params
+import glm
+import numpy as np
+from math import radians, tan
+from utils import findRotMat
+
+
+class StereoCameraModel:
+    """Intrinsics and pose of the rectified stereo pair of main_virtualcam.py."""
+
+    def __init__(self, fbZoom=None):
+        self.fbZoom = params.FB_ZOOM if fbZoom is None else fbZoom
+        self.fov = radians(params.CAM_FOV_DEGREES)
+        self.imgWidth = params.CAM_SENSOR_WIDTH * self.fbZoom
+        self.imgHeight = params.CAM_SENSOR_HEIGHT * self.fbZoom
+        self.fullImgWidth = self.imgWidth * 2
+        self.fullImgHeight = self.imgHeight
+
+        self.camXDelta = params.CAM_X_DELTA
+        self.camY = params.CAM_Y
+        self.camZ = params.CAM_Z
+
+        camPoseOrig = glm.vec3(0, 0, 1)
+        camPose = glm.vec3(*params.CAM_POSE)
+        self.camRotMat = findRotMat(camPoseOrig, camPose)
+
+        self.focalLength = self.imgWidth / (2 * tan(self.fov / 2))
+
+        # The same rotation and offset as plain arrays for the batched code.
+        # Image x grows towards the camera's right, which is world -x, so
+        # the camera frame is mirrored before it is rotated.
+        self.rotation = np.array(
+            [list((self.camRotMat * glm.vec4(*e, 0)).xyz) for e in np.eye(3)]
+        ).T @ np.diag([-1.0, 1.0, 1.0])
+        self.offset = np.array([0.0, self.camY, self.camZ])
+
+
+default = StereoCameraModel()
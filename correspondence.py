@@ -0,0 +1,80 @@
+import numpy as np
+import params
+
+EMPTY_MATCH = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+
+def disparityRange(camera):
+    # the markers are somewhere between STEREO_MIN_DEPTH and STEREO_MAX_DEPTH
+    # in front of the cameras, disparity = baseline * focal length / depth
+    bf = camera.camXDelta * camera.focalLength
+    return bf / params.STEREO_MAX_DEPTH, bf / params.STEREO_MIN_DEPTH
+
+
+def matchStereo(camera, ptsL, ptsR):
+    """Pairs up marker images of the rectified stereo pair.
+
+    ptsL, ptsR are (N, 2) centered image coordinates with y up. A left and a
+    right point are candidates when they lie on the same row within
+    params.STEREO_ROW_TOLERANCE and their disparity xL - xR is in the range
+    the depth limits allow. Candidates are found with a sort on y and binary
+    searches, then assigned greedily by cost, so each point is used at most
+    once; unmatched points (missing detections, outliers) are dropped.
+
+    Returns index arrays (idxL, idxR) ordered by idxL.
+    """
+    ptsL = np.asarray(ptsL, dtype=np.float64)
+    ptsR = np.asarray(ptsR, dtype=np.float64)
+    if len(ptsL) == 0 or len(ptsR) == 0:
+        return EMPTY_MATCH
+
+    rowTolerance = params.STEREO_ROW_TOLERANCE * camera.fbZoom
+    minDisparity, maxDisparity = disparityRange(camera)
+
+    # candidates: every right point whose row is within tolerance
+    orderR = np.argsort(ptsR[:, 1], kind="stable")
+    yR = ptsR[orderR, 1]
+    lo = np.searchsorted(yR, ptsL[:, 1] - rowTolerance, side="left")
+    hi = np.searchsorted(yR, ptsL[:, 1] + rowTolerance, side="right")
+    counts = hi - lo
+    total = counts.sum()
+    if total == 0:
+        return EMPTY_MATCH
+
+    candL = np.repeat(np.arange(len(ptsL)), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    candR = orderR[starts + np.arange(total)]
+
+    dy = np.abs(ptsL[candL, 1] - ptsR[candR, 1])
+    disparity = ptsL[candL, 0] - ptsR[candR, 0]
+    valid = (disparity >= minDisparity) & (disparity <= maxDisparity)
+    if not valid.any():
+        return EMPTY_MATCH
+    candL, candR, dy, disparity = (
+        candL[valid],
+        candR[valid],
+        dy[valid],
+        disparity[valid],
+    )
+
+    # Markers of one instrument are at similar depths, so pairs whose
+    # disparity is far from the typical one are likely wrong. This also
+    # decides between markers that share a row.
+    reference = np.median(disparity)
+    cost = dy / rowTolerance + np.abs(disparity - reference) / reference
+
+    usedL = np.zeros(len(ptsL), dtype=bool)
+    usedR = np.zeros(len(ptsR), dtype=bool)
+    matchL, matchR = [], []
+    for k in np.argsort(cost, kind="stable"):
+        l, r = candL[k], candR[k]
+        if usedL[l] or usedR[r]:
+            continue
+        usedL[l] = usedR[r] = True
+        matchL.append(l)
+        matchR.append(r)
+
+    matchL = np.array(matchL, dtype=np.intp)
+    matchR = np.array(matchR, dtype=np.intp)
+    order = np.argsort(matchL)
+    return matchL[order], matchR[order]
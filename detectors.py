@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import params
+import instrumentation
+
+# Marker detectors take a single channel uint8 image and return an (N, 3)
+# float32 array of circles (x, y, r) in pixel coordinates of that image.
+
+NO_CIRCLES = np.zeros((0, 3), dtype=np.float32)
+
+
+class HoughDetector:
+    def __init__(self, minDist=30, param1=50, param2=20):
+        self.minDist = minDist
+        self.param1 = param1
+        self.param2 = param2
+
+    def detect(self, gray):
+        # Blur using 3 * 3 kernel.
+        with instrumentation.span("blur"):
+            gray = cv2.GaussianBlur(gray, (3, 3), 2)
+
+        # Apply Hough transform on the blurred image.
+        detected_circles = cv2.HoughCircles(
+            gray,
+            cv2.HOUGH_GRADIENT,
+            1,
+            self.minDist,
+            param1=self.param1,
+            param2=self.param2,
+            minRadius=0,
+            maxRadius=0,
+        )
+        if detected_circles is None:
+            return NO_CIRCLES
+        return detected_circles[0].astype(np.float32)
+
+
+class BlobDetector:
+    """Bright discs on a dark background via threshold + connected components.
+
+    Centers are the intensity weighted centroids of each component, which uses
+    the anti-aliased rim and gives sub-pixel positions.
+    """
+
+    def __init__(self, threshold=None, minArea=None, maxArea=None):
+        self.threshold = params.BLOB_THRESHOLD if threshold is None else threshold
+        self.minArea = params.BLOB_MIN_AREA if minArea is None else minArea
+        self.maxArea = maxArea
+
+    def detect(self, gray):
+        _, mask = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY)
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(
+            mask, connectivity=8, ltype=cv2.CV_32S
+        )
+
+        h, w = gray.shape
+        circles = []
+        # label 0 is the background
+        for i in range(1, n):
+            x, y, bw, bh, area = stats[i]
+            if area < self.minArea:
+                continue
+            if self.maxArea is not None and area > self.maxArea:
+                continue
+
+            # grow the box by a pixel to take in the anti-aliased rim
+            x0, y0 = max(x - 1, 0), max(y - 1, 0)
+            x1, y1 = min(x + bw + 1, w), min(y + bh + 1, h)
+            roi = gray[y0:y1, x0:x1]
+            roiLabels = labels[y0:y1, x0:x1]
+            # ignore other components that share the box
+            weights = np.where((roiLabels == i) | (roiLabels == 0), roi, 0)
+
+            m = cv2.moments(weights.astype(np.float32))
+            if m["m00"] <= 0:
+                continue
+            cx = x0 + m["m10"] / m["m00"]
+            cy = y0 + m["m01"] / m["m00"]
+            circles.append((cx, cy, np.sqrt(area / np.pi)))
+
+        if not circles:
+            return NO_CIRCLES
+        return np.array(circles, dtype=np.float32)
+
+
+DETECTORS = {
+    "hough": HoughDetector,
+    "blob": BlobDetector,
+}
+
+
+def makeDetector(name):
+    try:
+        return DETECTORS[name]()
+    except KeyError:
+        raise ValueError("Unknown detector", name)
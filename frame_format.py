@@ -0,0 +1,38 @@
+from collections import namedtuple
+import numpy as np
+
+FrameFormat = namedtuple("FrameFormat", ["name", "dtype", "channels"])
+
+FLOAT32_BGR = FrameFormat("float32_bgr", np.dtype(np.float32), 3)
+UINT8_BGR = FrameFormat("uint8_bgr", np.dtype(np.uint8), 3)
+UINT8_GRAY = FrameFormat("uint8_gray", np.dtype(np.uint8), 1)
+
+FORMATS = {f.name: f for f in [FLOAT32_BGR, UINT8_BGR, UINT8_GRAY]}
+
+
+def getFormat(name):
+    # unknown names fall back to the original wire format
+    return FORMATS.get(name, FLOAT32_BGR)
+
+
+def findFormat(dtype, channels):
+    for fmt in FORMATS.values():
+        if fmt.dtype == np.dtype(dtype) and fmt.channels == channels:
+            return fmt
+    raise ValueError("no frame format for {} x {}".format(np.dtype(dtype), channels))
+
+
+def frameShape(fmt, width, height):
+    if fmt.channels == 1:
+        return (height, width)
+    return (height, width, fmt.channels)
+
+
+def frameBytes(fmt, width, height):
+    return width * height * fmt.channels * fmt.dtype.itemsize
+
+
+def toUint8(arr):
+    if arr.dtype == np.uint8:
+        return arr
+    return np.round(arr * 255).astype(np.uint8)
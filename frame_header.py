@@ -0,0 +1,94 @@
+from collections import namedtuple
+import struct
+import numpy as np
+
+# Every frame on the stream is preceded by this header. seq counts rendered
+# frames, so a gap means frames were dropped on the way; timestamp is the
+# time.time() the frame was rendered at. slot is the shm ring slot holding
+# the pixels, -1 when they follow on the socket.
+FrameHeader = namedtuple(
+    "FrameHeader",
+    [
+        "seq",
+        "timestamp",
+        "width",
+        "height",
+        "dtype",
+        "channels",
+        "origin",
+        "flags",
+        "slot",
+    ],
+)
+
+FRAME_MAGIC = b"SNFR"
+FRAME_VERSION = 1
+
+# magic, version, flags, seq, timestamp, width, height, channels, origin,
+# dtype string, slot
+_LAYOUT = struct.Struct("<4sHHqdIIHH4si")
+HEADER_SIZE = _LAYOUT.size
+
+ORIGINS = ["bottom-left", "top-left"]
+
+# flags
+# a header without a frame, sent while no frames are, to show the server is
+# still there
+FLAG_HEARTBEAT = 1
+
+
+def packHeader(header):
+    return _LAYOUT.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        header.flags,
+        header.seq,
+        header.timestamp,
+        header.width,
+        header.height,
+        header.channels,
+        ORIGINS.index(header.origin),
+        np.dtype(header.dtype).str.encode(),
+        header.slot,
+    )
+
+
+def unpackHeader(buf):
+    if len(buf) != HEADER_SIZE:
+        raise ValueError(
+            "frame header is {} bytes, not {}".format(len(buf), HEADER_SIZE)
+        )
+    (
+        magic,
+        version,
+        flags,
+        seq,
+        timestamp,
+        width,
+        height,
+        channels,
+        origin,
+        dtype,
+        slot,
+    ) = _LAYOUT.unpack(buf)
+    if magic != FRAME_MAGIC:
+        raise ValueError("not a frame header")
+    if version != FRAME_VERSION:
+        raise ValueError("unsupported frame header version {}".format(version))
+    return FrameHeader(
+        seq,
+        timestamp,
+        width,
+        height,
+        np.dtype(dtype.rstrip(b"\0").decode()),
+        channels,
+        ORIGINS[origin],
+        flags,
+        slot,
+    )
+
+
+def headerShape(header):
+    if header.channels == 1:
+        return (header.height, header.width)
+    return (header.height, header.width, header.channels)
@@ -0,0 +1,471 @@
+import multiprocessing.connection as mpc
+import socket
+import threading
+import time
+import numpy as np
+import params
+import instrumentation
+from shm_ring import ShmRing
+from frame_format import getFormat, frameShape
+from frame_header import (
+    FrameHeader,
+    FRAME_VERSION,
+    FLAG_HEARTBEAT,
+    packHeader,
+    unpackHeader,
+    headerShape,
+)
+
+STREAM_ADDRESS = ("127.0.0.1", 5001)
+
+# Each frame is a FrameHeader message. With the socket transport the pixels
+# follow as a second message, with shm the header names the ring slot.
+#
+# The server broadcasts to any number of subscribers (tracker, recorder,
+# monitors). Every frame is encoded once, into the shm ring and the header
+# messages, and then offered to every subscriber. Each subscriber has a
+# sender thread and a one frame mailbox where a newer frame replaces one not
+# sent yet, so a slow subscriber only drops its own frames and never holds
+# up the renderer or the others. While there are no frames the subscribers
+# get a heartbeat header every STREAM_HEARTBEAT seconds.
+
+
+class _EncodedFrame:
+    __slots__ = ["seq", "socketHeader", "shmHeader", "payload"]
+
+    def __init__(self, seq, socketHeader, shmHeader, payload):
+        self.seq = seq
+        self.socketHeader = socketHeader
+        self.shmHeader = shmHeader
+        self.payload = payload
+
+
+class _Subscriber:
+    def __init__(self, connection, address, transport, reader):
+        self.connection = connection
+        self.address = address
+        self.transport = transport
+        # index in the shm ring, -1 with the socket transport
+        self.reader = reader
+        self.cond = threading.Condition()
+        self.pending = None
+        self.stopped = False
+        self.lastSeq = 0
+        self.framesSent = 0
+        self.framesDropped = 0
+
+    def offer(self, frame):
+        with self.cond:
+            if self.pending is not None:
+                self.framesDropped += 1
+            self.pending = frame
+            self.cond.notify()
+
+    def take(self, timeout=None):
+        """The next frame, or None after timeout seconds or once stopped."""
+        with self.cond:
+            if self.pending is None and not self.stopped:
+                self.cond.wait(timeout)
+            frame, self.pending = self.pending, None
+            return frame
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def isIdle(self):
+        return self.pending is None
+
+
+class FrameStreamServer:
+    subscriberType = _Subscriber
+
+    def __init__(self, width, height, format=None, shm=True):
+        self.width = width
+        self.height = height
+        # negotiated with the first subscriber, the renderer reads back in it
+        # and later subscribers get it too, unless the frames only exist in
+        # one format
+        self.fixedFormat = format
+        self.format = format or getFormat(params.STREAM_FORMAT)
+        # without shm every subscriber gets every frame over the socket, shm
+        # clients skip to the newest slot in the ring
+        self.shm = shm
+        if shm and params.SHM_RING_SLOTS <= params.SHM_RING_READERS:
+            raise ValueError("SHM_RING_SLOTS has to be more than SHM_RING_READERS")
+
+        self.listener = None
+        self.acceptThread = None
+        self.encoderThread = None
+        # guards subscribers and the ring
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.ring = None
+
+        # latest submitted frame not encoded yet
+        self.cond = threading.Condition()
+        self.pending = None
+        self.framesDropped = 0
+        self.closed = False
+
+    def acceptInBackground(self):
+        if self.acceptThread is not None:
+            return
+        self.listener = mpc.Listener(STREAM_ADDRESS, "AF_INET")
+
+        def accept():
+            while True:
+                try:
+                    connection = self.listener.accept()
+                    address = self.listener.last_accepted
+                except (OSError, AttributeError):
+                    # listener closed
+                    return
+                if self.closed:
+                    connection.close()
+                    return
+                threading.Thread(
+                    target=self._serve, args=(connection, address), daemon=True
+                ).start()
+
+        self.acceptThread = threading.Thread(target=accept, daemon=True)
+        self.acceptThread.start()
+        self.encoderThread = threading.Thread(target=self._encodeLoop, daemon=True)
+        self.encoderThread.start()
+
+    def _serve(self, connection, address):
+        subscriber = None
+        try:
+            subscriber, welcome = self._subscribe(
+                connection.recv(), connection, address
+            )
+            connection.send(welcome)
+            while not subscriber.stopped:
+                frame = subscriber.take(params.STREAM_HEARTBEAT)
+                if subscriber.stopped:
+                    break
+                if frame is None:
+                    connection.send_bytes(self._heartbeat(subscriber.lastSeq))
+                    continue
+                with instrumentation.span("send"):
+                    self._send(subscriber, frame)
+        except (EOFError, ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        finally:
+            if subscriber is not None:
+                self._unsubscribe(subscriber)
+            connection.close()
+
+    def _send(self, subscriber, frame):
+        if subscriber.transport == "shm":
+            if frame.shmHeader is None:
+                # encoded before this subscriber brought up the ring
+                return
+            subscriber.connection.send_bytes(frame.shmHeader)
+        else:
+            subscriber.connection.send_bytes(frame.socketHeader)
+            subscriber.connection.send_bytes(frame.payload)
+        subscriber.framesSent += 1
+        subscriber.lastSeq = frame.seq
+
+    def _heartbeat(self, seq):
+        return packHeader(
+            FrameHeader(
+                seq,
+                time.time(),
+                self.width,
+                self.height,
+                self.format.dtype,
+                self.format.channels,
+                "bottom-left",
+                FLAG_HEARTBEAT,
+                -1,
+            )
+        )
+
+    def _encodeLoop(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                (arr, seq, timestamp), self.pending = self.pending, None
+            self._broadcast(arr, seq, timestamp)
+
+    def _broadcast(self, arr, seq, timestamp):
+        with instrumentation.span("encode"):
+            frame = self._encode(arr, seq, timestamp)
+        if frame is None:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(frame)
+
+    def _encode(self, arr, seq, timestamp):
+        shape = frameShape(self.format, self.width, self.height)
+        if arr.shape != shape or arr.dtype != self.format.dtype:
+            # rendered before the format was renegotiated
+            return None
+
+        def header(slot):
+            return packHeader(
+                FrameHeader(
+                    seq,
+                    timestamp,
+                    self.width,
+                    self.height,
+                    self.format.dtype,
+                    self.format.channels,
+                    "bottom-left",
+                    0,
+                    slot,
+                )
+            )
+
+        shmHeader = None
+        with self.lock:
+            if self.ring is not None and any(
+                s.transport == "shm" for s in self.subscribers
+            ):
+                _, slot = self.ring.write(arr, seq)
+                shmHeader = header(slot)
+        # sent as is by every socket subscriber, no copy
+        payload = memoryview(np.ascontiguousarray(arr).reshape(-1).view(np.uint8))
+        return _EncodedFrame(seq, header(-1), shmHeader, payload)
+
+    def _subscribe(self, hello, connection, address):
+        """Registers a subscriber for a client hello, returns it and the
+        welcome to answer with."""
+        transport = hello.get("transport", "socket")
+
+        with self.lock:
+            if not self.subscribers:
+                # the first subscriber picks the format
+                self.format = self.fixedFormat or getFormat(hello.get("format"))
+            fmt = self.format
+            shape = frameShape(fmt, self.width, self.height)
+
+            if self.ring is not None and (
+                self.ring.shape != shape or self.ring.dtype != fmt.dtype
+            ):
+                self.ring.close()
+                self.ring = None
+
+            reader = -1
+            if transport == "shm" and not self.shm:
+                transport = "socket"
+            if transport == "shm":
+                if self.ring is None:
+                    try:
+                        self.ring = ShmRing.create(
+                            params.SHM_RING_SLOTS,
+                            shape,
+                            fmt.dtype,
+                            params.SHM_RING_READERS,
+                        )
+                    except OSError:
+                        pass
+                taken = {s.reader for s in self.subscribers}
+                free = [r for r in range(params.SHM_RING_READERS) if r not in taken]
+                if self.ring is None or not free:
+                    transport = "socket"
+                else:
+                    reader = free[0]
+
+            subscriber = self.subscriberType(connection, address, transport, reader)
+
+            welcome = {
+                "version": FRAME_VERSION,
+                "transport": transport,
+                "format": fmt.name,
+                "shape": shape,
+                "dtype": fmt.dtype.str,
+                # rows arrive as glReadPixels returns them
+                "origin": "bottom-left",
+            }
+            if transport == "shm":
+                welcome["name"] = self.ring.name()  # type: ignore
+                welcome["slots"] = self.ring.slots  # type: ignore
+                welcome["readers"] = self.ring.readers  # type: ignore
+                welcome["reader"] = reader
+            self.subscribers.append(subscriber)
+        return subscriber, welcome
+
+    def _unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.remove(subscriber)
+            if subscriber.reader >= 0 and self.ring is not None:
+                self.ring.release(subscriber.reader)
+
+    def hasSubscribers(self):
+        return bool(self.subscribers)
+
+    def canSubmit(self):
+        """True when there are subscribers and every one of them has sent the
+        last frame, so the next one reaches all of them."""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        return (
+            bool(subscribers)
+            and self.pending is None
+            and all(s.isIdle() for s in subscribers)
+        )
+
+    def subscriberStats(self):
+        """(address, transport, framesSent, framesDropped) per subscriber."""
+        with self.lock:
+            return [
+                (s.address, s.transport, s.framesSent, s.framesDropped)
+                for s in self.subscribers
+            ]
+
+    def submit(self, arr, seq, timestamp):
+        """Hands a frame to the subscribers, seq and timestamp as in
+        FrameHeader. Never blocks: a frame not encoded yet is replaced by the
+        new one. Subscribers see dropped frames as gaps in seq.
+        """
+        with self.cond:
+            replaced = self.pending is not None
+            if replaced:
+                self.framesDropped += 1
+            self.pending = (arr, seq, timestamp)
+            self.cond.notify()
+        return not replaced
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.listener is not None:
+            # the socket keeps listening while accept() blocks on it, so the
+            # accept thread is woken first
+            try:
+                socket.create_connection(STREAM_ADDRESS, timeout=1.0).close()
+            except OSError:
+                pass
+            self.acceptThread.join(timeout=1.0)  # type: ignore
+            self.listener.close()
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.stop()
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+
+class FrameStreamClient:
+    def __init__(self, transport=None, format=None):
+        self.transport = transport or params.STREAM_TRANSPORT
+        self.format = getFormat(format or params.STREAM_FORMAT)
+        self.client = None
+        self.welcome = None
+        self.ring = None
+        # rings of earlier connections with frames still referenced
+        self.staleRings = []
+
+        # header of the frame last returned by recvFrame()
+        self.header = None
+        self.framesReceived = 0
+        self.framesDropped = 0
+
+    def isConnected(self):
+        return self.client is not None
+
+    def _connect(self):
+        try:
+            client = mpc.Client(STREAM_ADDRESS, "AF_INET")
+        except ConnectionError:
+            return False
+
+        try:
+            client.send({"transport": self.transport, "format": self.format.name})
+            welcome = client.recv()
+        except (EOFError, ConnectionError):
+            # the server went away during the handshake
+            client.close()
+            return False
+        self.format = getFormat(welcome["format"])
+
+        if welcome["transport"] == "shm":
+            self.ring = ShmRing.attach(
+                welcome["name"],
+                welcome["slots"],
+                welcome["shape"],
+                welcome["dtype"],
+                welcome["readers"],
+                welcome["reader"],
+            )
+
+        self.client = client
+        self.welcome = welcome
+        return True
+
+    def _disconnect(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.ring is not None:
+            # the caller may still hold a view into it
+            self.staleRings.append(self.ring)
+            self.ring = None
+        self._closeStaleRings()
+        self.welcome = None
+        self.header = None
+
+    def _closeStaleRings(self):
+        stale = []
+        for ring in self.staleRings:
+            try:
+                ring.close()
+            except BufferError:
+                # a frame from it is still referenced
+                stale.append(ring)
+        self.staleRings = stale
+
+    def recvFrame(self):
+        """Returns the next frame, or None if the server is not reachable.
+
+        With the shm transport the returned array is a read-only view into the
+        ring and is only valid until the next call.
+        """
+        self._closeStaleRings()
+        if self.client is None and not self._connect():
+            return None
+
+        try:
+            header = unpackHeader(self.client.recv_bytes())  # type: ignore
+            while header.flags & FLAG_HEARTBEAT:
+                header = unpackHeader(self.client.recv_bytes())  # type: ignore
+            if self.ring is None:
+                payload = self.client.recv_bytes()  # type: ignore
+            else:
+                # skip to the most recent header, older slots may be gone
+                while self.client.poll(0):  # type: ignore
+                    latest = unpackHeader(self.client.recv_bytes())  # type: ignore
+                    if not latest.flags & FLAG_HEARTBEAT:
+                        header = latest
+        except (EOFError, ConnectionResetError):
+            self._disconnect()
+            return None
+
+        if self.ring is None:
+            frame = np.frombuffer(payload, header.dtype).reshape(headerShape(header))
+        else:
+            frame = self.ring.view(header.seq, header.slot)
+            if frame is None:
+                return None
+
+        if self.header is not None and header.seq > self.header.seq:
+            self.framesDropped += header.seq - self.header.seq - 1
+        self.framesReceived += 1
+        self.header = header
+        return frame
+
+    def isBottomUp(self):
+        return self.header is not None and self.header.origin == "bottom-left"
+
+    def close(self):
+        self._disconnect()
@@ -0,0 +1,428 @@
+import asyncio
+import pickle
+import socket
+import struct
+import threading
+import numpy as np
+import params
+import instrumentation
+from shm_ring import ShmRing
+from frame_format import getFormat
+from frame_header import FLAG_HEARTBEAT, HEADER_SIZE, unpackHeader
+from frame_stream import STREAM_ADDRESS, FrameStreamServer, _Subscriber
+
+# The frame stream on asyncio, selected with params.STREAM_IO. On the wire
+# it is the same as frame_stream.py: multiprocessing.connection messages,
+# a 4 byte big-endian length and the bytes, with a pickled hello and
+# welcome, so either server works with either client.
+#
+# Both run their event loop on a thread of their own and keep the API of
+# the threaded versions, so the apps can use them as drop-ins. Frames are
+# written from memoryviews with writelines() and read with sock_recv_into()
+# into buffers allocated once per connection.
+
+_LENGTH = struct.Struct("!i")
+_LONG_LENGTH = struct.Struct("!Q")
+
+
+def _message(data):
+    return _LENGTH.pack(len(data)) + data
+
+
+class _AsyncSubscriber(_Subscriber):
+    # lives on the event loop, offer() and take() are only called there
+
+    def __init__(self, writer, address, transport, reader):
+        super().__init__(writer, address, transport, reader)
+        self.ready = asyncio.Event()
+
+    def offer(self, frame):
+        if self.pending is not None:
+            self.framesDropped += 1
+        self.pending = frame
+        self.ready.set()
+
+    async def take(self, timeout=None):
+        if self.pending is None and not self.stopped:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.ready.clear()
+        frame, self.pending = self.pending, None
+        return frame
+
+    def stop(self):
+        self.stopped = True
+        self.ready.set()
+
+
+class AsyncFrameStreamServer(FrameStreamServer):
+    """FrameStreamServer with the connections served by one event loop.
+
+    Every subscriber is a task. After each frame it waits for the socket to
+    drain, newer frames replace the one waiting in its mailbox meanwhile.
+    """
+
+    subscriberType = _AsyncSubscriber
+
+    def __init__(self, width, height, format=None, shm=True):
+        super().__init__(width, height, format, shm)
+        self.loop = None
+        self.loopThread = None
+        self.stopping = None
+        self.frameReady = None
+        self.tasks = set()
+        self.started = threading.Event()
+        self.error = None
+
+    def acceptInBackground(self):
+        if self.loopThread is not None:
+            return
+        self.loopThread = threading.Thread(
+            target=asyncio.run, args=(self.serve(),), daemon=True
+        )
+        self.loopThread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.frameReady = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._serveClient, *STREAM_ADDRESS)
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            return
+        encoder = asyncio.create_task(self._encodeLoop())
+        self.started.set()
+
+        try:
+            await self.stopping.wait()
+        finally:
+            # subscribers first, the server waits for its connections to close
+            encoder.cancel()
+            for subscriber in list(self.subscribers):
+                subscriber.stop()
+            await asyncio.gather(encoder, *self.tasks, return_exceptions=True)
+            server.close()
+            await server.wait_closed()
+            with self.lock:
+                if self.ring is not None:
+                    self.ring.close()
+                    self.ring = None
+
+    async def _serveClient(self, reader, writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        subscriber = None
+        try:
+            length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+            hello = pickle.loads(await reader.readexactly(length))
+            subscriber, welcome = self._subscribe(
+                hello, writer, writer.get_extra_info("peername")
+            )
+            writer.write(_message(pickle.dumps(welcome)))
+
+            while True:
+                frame = await subscriber.take(params.STREAM_HEARTBEAT)
+                if subscriber.stopped:
+                    break
+                if frame is None:
+                    writer.write(_message(self._heartbeat(subscriber.lastSeq)))
+                    await writer.drain()
+                    continue
+                with instrumentation.span("send"):
+                    self._write(subscriber, frame)
+                    # backpressure, a slow client drops frames from here
+                    await writer.drain()
+        except (ConnectionError, EOFError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if subscriber is not None:
+                self._unsubscribe(subscriber)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.tasks.discard(task)
+
+    def _write(self, subscriber, frame):
+        writer = subscriber.connection
+        if subscriber.transport == "shm":
+            if frame.shmHeader is None:
+                # encoded before this subscriber brought up the ring
+                return
+            writer.write(_message(frame.shmHeader))
+        else:
+            writer.writelines(
+                [
+                    _message(frame.socketHeader),
+                    _LENGTH.pack(frame.payload.nbytes),
+                    frame.payload,
+                ]
+            )
+        subscriber.framesSent += 1
+        subscriber.lastSeq = frame.seq
+
+    async def _encodeLoop(self):
+        while True:
+            await self.frameReady.wait()  # type: ignore
+            self.frameReady.clear()  # type: ignore
+            with self.cond:
+                pending, self.pending = self.pending, None
+            if pending is not None:
+                self._broadcast(*pending)
+
+    def submit(self, arr, seq, timestamp):
+        """Thread safe, see FrameStreamServer.submit()."""
+        submitted = super().submit(arr, seq, timestamp)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.frameReady.set)  # type: ignore
+        return submitted
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)  # type: ignore
+            self.loopThread.join(timeout=2.0)  # type: ignore
+            self.loop = None
+
+
+class AsyncFrameStreamClient:
+    """FrameStreamClient with the connection kept up by an event loop.
+
+    The loop reconnects with a growing delay, reads every message as it
+    arrives and reconnects after STREAM_TIMEOUT seconds without one.
+    recvFrame() hands out the latest frame received, it never waits for a
+    connection. Socket frames are read into three buffers in turn, one
+    being received, one ready and one held by the caller, so the frame
+    returned stays valid until the next call, as with shm.
+
+    From a coroutine, use run() and nextFrame() instead of recvFrame().
+    """
+
+    def __init__(self, transport=None, format=None):
+        self.transport = transport or params.STREAM_TRANSPORT
+        self.format = getFormat(format or params.STREAM_FORMAT)
+        self.welcome = None
+        self.ring = None
+        self.sock = None
+
+        # header of the frame last returned by recvFrame()
+        self.header = None
+        self.framesReceived = 0
+        self.framesDropped = 0
+
+        self.buffers = []
+        self.receiving, self.ready, self.held = 0, 1, 2
+        # header of the latest frame received and not taken yet
+        self.latest = None
+        self.cond = threading.Condition()
+        self.published = None
+        # rings of past connections, closed once their frames are given up
+        self.staleRings = []
+
+        self.lengthBuf = bytearray(_LONG_LENGTH.size)
+        self.headerBuf = bytearray(HEADER_SIZE)
+
+        self.loop = None
+        self.loopThread = None
+        self.runTask = None
+
+    def startInBackground(self):
+        if self.loopThread is not None:
+            return
+        started = threading.Event()
+
+        async def main():
+            self.loop = asyncio.get_running_loop()
+            self.runTask = asyncio.current_task()
+            started.set()
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                pass
+
+        self.loopThread = threading.Thread(
+            target=asyncio.run, args=(main(),), daemon=True
+        )
+        self.loopThread.start()
+        started.wait()
+
+    def isConnected(self):
+        return self.welcome is not None
+
+    async def run(self):
+        """Keeps the connection up and receives frames until cancelled."""
+        loop = asyncio.get_running_loop()
+        self.published = asyncio.Event()
+        first, longest = params.STREAM_RECONNECT_DELAY
+        delay = first
+        while True:
+            try:
+                await self._connect(loop)
+                delay = first
+                while True:
+                    await asyncio.wait_for(self._receive(loop), params.STREAM_TIMEOUT)
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError):
+                pass
+            finally:
+                self._disconnect()
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, longest)
+
+    async def _connect(self, loop):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        self.sock = sock
+        await asyncio.wait_for(
+            loop.sock_connect(sock, STREAM_ADDRESS), params.STREAM_TIMEOUT
+        )
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        hello = {"transport": self.transport, "format": self.format.name}
+        await loop.sock_sendall(sock, _message(pickle.dumps(hello)))
+        welcome = await asyncio.wait_for(self._recvWelcome(loop), params.STREAM_TIMEOUT)
+        self.format = getFormat(welcome["format"])
+
+        if welcome["transport"] == "shm":
+            self.ring = ShmRing.attach(
+                welcome["name"],
+                welcome["slots"],
+                welcome["shape"],
+                welcome["dtype"],
+                welcome["readers"],
+                welcome["reader"],
+            )
+        else:
+            shape, dtype = tuple(welcome["shape"]), np.dtype(welcome["dtype"])
+            with self.cond:
+                if not self.buffers or self.buffers[0].shape != shape:
+                    self.buffers = [np.empty(shape, dtype) for _ in range(3)]
+                elif self.buffers[0].dtype != dtype:
+                    self.buffers = [np.empty(shape, dtype) for _ in range(3)]
+        self.welcome = welcome
+
+    async def _recvWelcome(self, loop):
+        data = bytearray(await self._recvLength(loop))
+        await self._recvInto(loop, memoryview(data))
+        return pickle.loads(data)
+
+    async def _recvInto(self, loop, view):
+        while len(view):
+            n = await loop.sock_recv_into(self.sock, view)
+            if n == 0:
+                raise EOFError
+            view = view[n:]
+
+    async def _recvLength(self, loop):
+        view = memoryview(self.lengthBuf)
+        await self._recvInto(loop, view[: _LENGTH.size])
+        length = _LENGTH.unpack_from(self.lengthBuf)[0]
+        if length == -1:
+            # multiprocessing.connection's prefix for messages over 2 GiB
+            await self._recvInto(loop, view)
+            length = _LONG_LENGTH.unpack_from(self.lengthBuf)[0]
+        return length
+
+    async def _receive(self, loop):
+        if await self._recvLength(loop) != HEADER_SIZE:
+            raise ValueError("expected a frame header")
+        await self._recvInto(loop, memoryview(self.headerBuf))
+        header = unpackHeader(self.headerBuf)
+        if header.flags & FLAG_HEARTBEAT:
+            return
+
+        if self.ring is None:
+            buffer = self.buffers[self.receiving]
+            if await self._recvLength(loop) != buffer.nbytes:
+                raise ValueError("frame size doesn't match the welcome")
+            await self._recvInto(loop, memoryview(buffer).cast("B"))
+
+        with self.cond:
+            if self.ring is None:
+                self.receiving, self.ready = self.ready, self.receiving
+            self.latest = header
+            self.cond.notify_all()
+        self.published.set()  # type: ignore
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        with self.cond:
+            if self.ring is not None:
+                # the caller may still hold a view into it
+                self.staleRings.append(self.ring)
+                self.ring = None
+            self.welcome = None
+            self.latest = None
+
+    def _closeStaleRings(self):
+        stale = []
+        for ring in self.staleRings:
+            try:
+                ring.close()
+            except BufferError:
+                # a frame from it is still referenced
+                stale.append(ring)
+        self.staleRings = stale
+
+    def _take(self):
+        with self.cond:
+            self._closeStaleRings()
+
+            header, self.latest = self.latest, None
+            if header is None:
+                return None
+            if self.ring is None:
+                self.ready, self.held = self.held, self.ready
+                frame = self.buffers[self.held].view()
+                frame.flags.writeable = False
+            else:
+                frame = self.ring.view(header.seq, header.slot)
+                if frame is None:
+                    return None
+
+        if self.header is not None and header.seq > self.header.seq:
+            self.framesDropped += header.seq - self.header.seq - 1
+        self.framesReceived += 1
+        self.header = header
+        return frame
+
+    async def nextFrame(self):
+        """Waits for the next frame on the loop run() is on."""
+        while True:
+            await self.published.wait()  # type: ignore
+            self.published.clear()  # type: ignore
+            frame = self._take()
+            if frame is not None:
+                return frame
+
+    def recvFrame(self):
+        """Returns the latest frame, waiting up to STREAM_TIMEOUT for one, or
+        None if the server is not reachable."""
+        self.startInBackground()
+        with self.cond:
+            if self.welcome is None:
+                return None
+            if self.latest is None:
+                self.cond.wait(params.STREAM_TIMEOUT)
+        return self._take()
+
+    def isBottomUp(self):
+        return self.header is not None and self.header.origin == "bottom-left"
+
+    def close(self):
+        if self.loop is not None and self.runTask is not None:
+            self.loop.call_soon_threadsafe(self.runTask.cancel)
+            self.loopThread.join(timeout=2.0)  # type: ignore
+            self.loop = None
+            self.loopThread = None
+        self.header = None
+        with self.cond:
+            self._closeStaleRings()
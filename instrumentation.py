@@ -0,0 +1,153 @@
+import itertools
+import time
+from contextlib import nullcontext
+import numpy as np
+import params
+
+# Named timing spans for both apps. Every span keeps its last
+# INSTRUMENTATION_SAMPLES durations in a ring; slots are claimed with an
+# itertools.count, which is atomic, so threads record without locks.
+#
+#   with instrumentation.span("detect"):
+#       ...
+#
+# When params.INSTRUMENTATION is off span() hands out one shared no-op
+# context and record() returns right away.
+
+SPANS = [
+    "frame",
+    "render",
+    "readback",
+    "enqueue",
+    "encode",
+    "send",
+    "receive",
+    "convert",
+    "blur",
+    "detect",
+    "match",
+    "triangulate",
+    "identify",
+    "draw",
+    "render to pose",
+]
+
+enabled = params.INSTRUMENTATION
+
+_NULL_SPAN = nullcontext()
+# perf_counter() + _CLOCK_OFFSET is time.time(), for dumps from two processes
+_CLOCK_OFFSET = time.time() - time.perf_counter()
+
+
+class SpanRing:
+    def __init__(self, size):
+        self.size = size
+        self.starts = np.zeros(size)
+        self.durations = np.zeros(size)
+        self.counter = itertools.count()
+        self.count = 0
+
+    def add(self, start, seconds):
+        i = next(self.counter)
+        self.starts[i % self.size] = start
+        self.durations[i % self.size] = seconds
+        self.count = max(self.count, i + 1)
+
+    def samples(self):
+        n = min(self.count, self.size)
+        return self.starts[:n].copy(), self.durations[:n].copy()
+
+
+_rings = {name: SpanRing(params.INSTRUMENTATION_SAMPLES) for name in SPANS}
+
+
+def _ring(name):
+    ring = _rings.get(name)
+    if ring is None:
+        ring = _rings.setdefault(name, SpanRing(params.INSTRUMENTATION_SAMPLES))
+    return ring
+
+
+class _Span:
+    __slots__ = ["ring", "start"]
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ring.add(self.start, time.perf_counter() - self.start)
+
+
+def span(name):
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(_ring(name))
+
+
+def record(name, seconds, start=None):
+    """Adds a duration measured elsewhere, start is a perf_counter() time."""
+    if not enabled:
+        return
+    if start is None:
+        start = time.perf_counter() - seconds
+    _ring(name).add(start, seconds)
+
+
+def reset():
+    for name in list(_rings):
+        _rings[name] = SpanRing(params.INSTRUMENTATION_SAMPLES)
+
+
+def summary():
+    """{name: (count, p50, p95, p99)} in milliseconds for spans with samples."""
+    result = {}
+    for name, ring in _rings.items():
+        _, durations = ring.samples()
+        if len(durations) == 0:
+            continue
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+        result[name] = (ring.count, p50, p95, p99)
+    return result
+
+
+def drawImGui(title="Timings"):
+    # only the apps have imgui, the tracker runs without it
+    import imgui
+
+    if imgui.begin(title):
+        if not enabled:
+            imgui.text("Off (params.INSTRUMENTATION)")
+        imgui.text(
+            "{:14s} {:>7s} {:>7s} {:>7s} {:>8s}".format(
+                "ms", "p50", "p95", "p99", "count"
+            )
+        )
+        for name, (count, p50, p95, p99) in summary().items():
+            imgui.text(
+                "{:14s} {:7.2f} {:7.2f} {:7.2f} {:8d}".format(
+                    name, p50, p95, p99, count
+                )
+            )
+        imgui.end()
+
+
+def dump(path):
+    """Writes every sample still in the rings as span,start,duration_ms rows,
+    start in time.time() seconds."""
+    if not enabled:
+        return
+    with open(path, "w") as file:
+        file.write("span,start,duration_ms\n")
+        for name, ring in _rings.items():
+            starts, durations = ring.samples()
+            order = np.argsort(starts)
+            for start, duration in zip(starts[order], durations[order]):
+                file.write(
+                    "{},{:.6f},{:.4f}\n".format(
+                        name, start + _CLOCK_OFFSET, duration * 1000
+                    )
+                )
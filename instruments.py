@@ -0,0 +1,311 @@
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+import params
+
+# rot is a 3x3 rotation from instrument to world coordinates, pos the world
+# position of the instrument origin, dir its axis in world coordinates and
+# markers the indices of the triangulated points it was built from, per
+# model marker, -1 where a marker wasn't seen
+InstrumentPose = namedtuple(
+    "InstrumentPose", ["name", "pos", "rot", "dir", "rmsError", "markers"]
+)
+
+
+def loadMarkers(objPath, material):
+    """Centers of the marker spheres in an OBJ file.
+
+    Every connected group of faces drawn with the given material is one
+    marker; its center is the mean of its vertices.
+    """
+    vertices = []
+    faces = []
+    curMtl = None
+    with open(objPath, "r") as file:
+        for line in file.readlines():
+            if line.startswith("v "):
+                vertices.append([float(v) for v in line.split()[1:4]])
+            elif line.startswith("usemtl "):
+                curMtl = line.split()[1]
+            elif line.startswith("f ") and curMtl == material:
+                faces.append([int(v.split("/")[0]) - 1 for v in line.split()[1:]])
+    vertices = np.array(vertices)
+
+    parent = {}
+
+    def find(v):
+        while parent.setdefault(v, v) != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for face in faces:
+        for v in face[1:]:
+            parent[find(v)] = find(face[0])
+
+    groups = {}
+    for v in list(parent):
+        groups.setdefault(find(v), []).append(v)
+
+    centers = [vertices[group].mean(axis=0) for group in groups.values()]
+    # deterministic marker order
+    centers.sort(key=lambda c: tuple(c))
+    return np.array(centers)
+
+
+@lru_cache(maxsize=None)
+def _pairs(count):
+    # index pairs i < j of count points, the same for most frames
+    rows, cols = np.triu_indices(count, 1)
+    return rows, cols, list(zip(rows.tolist(), cols.tolist()))
+
+
+def rotationBetween(u, v):
+    """Smallest rotation taking unit vector u onto unit vector v."""
+    (ux, uy, uz), (vx, vy, vz) = u.tolist(), v.tolist()
+    # np.cross costs more than the rest of this together
+    axis = np.array([uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx])
+    s = np.sqrt(axis @ axis)
+    c = u @ v
+    if s < 1e-9:
+        return np.eye(3)
+    x, y, z = axis / s
+    k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + s * k + (1 - c) * (k @ k)
+
+
+def fitRigid(model, points):
+    """Least squares rotation and translation with rot @ model + pos = points."""
+    mc = model.mean(axis=0)
+    pc = points.mean(axis=0)
+    h = (model - mc).T @ (points - pc)
+    u, _, vt = np.linalg.svd(h)
+    # no reflections
+    s = np.diag([1.0, 1.0, np.sign(np.linalg.det(vt.T @ u.T))])
+    rot = vt.T @ s @ u.T
+    pos = pc - rot @ mc
+    residual = points - (model @ rot.T + pos)
+    return rot, pos, np.sqrt((residual**2).sum(axis=1).mean())
+
+
+class InstrumentModel:
+    def __init__(self, name, objPath, markers=None, axis=(0, 0, 1)):
+        self.name = name
+        self.objPath = objPath
+        if markers is None:
+            markers = loadMarkers(objPath, params.INSTRUMENT_MARKER_MATERIAL)
+        self.markers = np.asarray(markers, dtype=np.float64)
+        self.axis = np.asarray(axis, dtype=np.float64)
+
+        diff = self.markers[:, None, :] - self.markers[None, :, :]
+        self.distances = np.sqrt((diff**2).sum(axis=-1))
+        # other labellings of the markers that match within tolerance, as
+        # permutations: marker k may just as well be marker perm[k]
+        self.relabellings = self._relabellings(params.INSTRUMENT_DISTANCE_TOLERANCE)
+        # well within the matching tolerance, which near symmetries pass
+        self.symmetries = self._symmetries(params.INSTRUMENT_DISTANCE_TOLERANCE / 10)
+
+    @property
+    def relabelable(self):
+        return bool(self.relabellings)
+
+    @property
+    def symmetric(self):
+        """Whether the markers alone can't tell the roll apart."""
+        return bool(self.symmetries)
+
+    def _relabellings(self, tolerance):
+        # distance preserving permutations other than the identity, built
+        # up one marker at a time
+        count = len(self.markers)
+        found = []
+
+        def extend(perm):
+            k = len(perm)
+            if k == count:
+                if perm != list(range(count)):
+                    found.append(np.array(perm))
+                return
+            for c in range(count):
+                if c not in perm and all(
+                    abs(self.distances[k, j] - self.distances[c, perm[j]]) <= tolerance
+                    for j in range(k)
+                ):
+                    extend(perm + [c])
+
+        extend([])
+        return found
+
+    def _symmetries(self, tolerance):
+        # Rotations other than the identity that map the markers onto
+        # themselves, as (rot, shift) with rot @ marker + shift another
+        # marker.
+        found = []
+        for perm in self._relabellings(tolerance):
+            rot, shift, err = fitRigid(self.markers, self.markers[perm])
+            if err <= tolerance:
+                found.append((rot, shift))
+        return found
+
+    def canonicalPose(self, rot, pos):
+        """Of the poses the symmetries can't tell apart, the one whose roll
+        is closest to the smallest rotation onto its direction, so fits of
+        the same pose don't flip between them from frame to frame."""
+        swing = rotationBetween(self.axis, rot @ self.axis)
+        best, bestPos = rot, pos
+        for sym, shift in self.symmetries:
+            other = rot @ sym
+            if np.trace(swing.T @ other) > np.trace(swing.T @ best):
+                best, bestPos = other, pos + rot @ shift
+        return best, bestPos
+
+
+class InstrumentRegistry:
+    """Identifies rigid marker bodies in a triangulated point cloud.
+
+    Every marker pair of every model goes into a lookup index keyed by their
+    quantized distance. A pair of points with a matching distance seeds a
+    hypothesis, the remaining markers are found by their distances to the
+    seed pair, and the best fitting hypotheses win, each point belonging to
+    at most one instrument. Markers without a point are left out of the fit,
+    as long as params.INSTRUMENT_MIN_MARKERS are seen.
+    """
+
+    def __init__(self, models, tolerance=None):
+        self.models = list(models)
+        self.tolerance = (
+            params.INSTRUMENT_DISTANCE_TOLERANCE if tolerance is None else tolerance
+        )
+
+        self.index = {}
+        for m, model in enumerate(self.models):
+            count = len(model.markers)
+            for i in range(count):
+                for j in range(i + 1, count):
+                    key = self._key(model.distances[i, j])
+                    self.index.setdefault(key, []).append((m, i, j))
+
+    @classmethod
+    def fromParams(cls):
+        return cls(InstrumentModel(name, path) for name, path in params.INSTRUMENTS)
+
+    def _key(self, distance):
+        return int(np.rint(distance / self.tolerance))
+
+    def _extend(self, model, dists, seed):
+        # assign the remaining markers given two seed (marker, point) pairs,
+        # markers without a point in tolerance stay unassigned (-1)
+        (i, a), (j, b) = seed
+        # how far every point is off every marker's distances to the seeds
+        err = np.maximum(
+            np.abs(dists[a] - model.distances[i][:, None]),
+            np.abs(dists[b] - model.distances[j][:, None]),
+        )
+        err[:, [a, b]] = np.inf
+        assignment = np.full(len(model.markers), -1)
+        assignment[i], assignment[j] = a, b
+        for k in range(len(model.markers)):
+            if assignment[k] >= 0:
+                continue
+            c = int(err[k].argmin())
+            if err[k, c] <= self.tolerance:
+                assignment[k] = c
+                err[:, c] = np.inf
+        if (assignment >= 0).sum() < params.INSTRUMENT_MIN_MARKERS:
+            return None
+        return assignment
+
+    def identify(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) < params.INSTRUMENT_MIN_MARKERS:
+            return []
+
+        diff = points[:, None, :] - points[None, :, :]
+        dists = np.sqrt((diff**2).sum(axis=-1))
+        rows, cols, pointPairs = _pairs(len(points))
+        keys = np.rint(dists[rows, cols] / self.tolerance).astype(int)
+
+        # (model, marker, point, marker, point) of every marker pair an
+        # assignment was built with; seeding from one of them again would
+        # only build the same assignment
+        explained = set()
+        # points of a fit with as many markers as the frame can show; other
+        # labellings of them come from the model's relabellings
+        covered = [set() for _ in self.models]
+        hypotheses = []
+        for (a, b), key in zip(pointPairs, keys.tolist()):
+            for k in (key - 1, key, key + 1):
+                for m, i, j in self.index.get(k, []):
+                    model = self.models[m]
+                    if a in covered[m] and b in covered[m]:
+                        continue
+                    if abs(dists[a, b] - model.distances[i, j]) > self.tolerance:
+                        continue
+                    for seed in (((i, a), (j, b)), ((i, b), (j, a))):
+                        if a in covered[m] and b in covered[m]:
+                            break
+                        if (m,) + seed[0] + seed[1] in explained:
+                            continue
+                        assignment = self._extend(model, dists, seed)
+                        if assignment is None:
+                            continue
+                        pairs = [(n, c) for n, c in enumerate(assignment) if c >= 0]
+                        explained.update(
+                            (m,) + p + q
+                            for n, p in enumerate(pairs)
+                            for q in pairs[n + 1 :]
+                        )
+                        hypotheses.append((m, assignment, len(pairs)))
+                        full = min(len(model.markers), len(points))
+                        if len(pairs) == full:
+                            covered[m].update(c for _, c in pairs)
+                            for perm in model.relabellings:
+                                hypotheses.append((m, assignment[perm], len(pairs)))
+
+        # Only the hypotheses with the most markers of their model are fit,
+        # and of labellings of the same points only the one whose distances
+        # match best; the symmetries of the model settle the rest.
+        best = {}
+        for m, model in enumerate(self.models):
+            candidates = [h[1] for h in hypotheses if h[0] == m]
+            if not candidates:
+                continue
+            counts = [(c >= 0).sum() for c in candidates]
+            candidates = [c for c, n in zip(candidates, counts) if n == max(counts)]
+            # squared distance error over every pair of assigned markers,
+            # for all of them at once
+            assigned = np.array(candidates)
+            seen = assigned >= 0
+            idx = np.where(seen, assigned, 0)
+            err = dists[idx[:, :, None], idx[:, None, :]] - model.distances
+            err *= seen[:, :, None] & seen[:, None, :]
+            scores = (err * err).sum(axis=(1, 2)).tolist()
+            for assignment, score in zip(candidates, scores):
+                key = (m, frozenset(assignment[assignment >= 0].tolist()))
+                if key not in best or score < best[key][0]:
+                    best[key] = (score, m, assignment)
+        fits = [self._fit(m, assignment, points) for _, m, assignment in best.values()]
+        fits.sort(key=lambda fit: fit[:2])
+
+        poses = []
+        usedModels = set()
+        usedPoints = set()
+        for _, err, m, assignment, rot, pos in fits:
+            found = assignment[assignment >= 0].tolist()
+            if m in usedModels or usedPoints.intersection(found):
+                continue
+            usedModels.add(m)
+            usedPoints.update(found)
+            model = self.models[m]
+            poses.append(
+                InstrumentPose(model.name, pos, rot, rot @ model.axis, err, assignment)
+            )
+        return poses
+
+    def _fit(self, m, assignment, points):
+        model = self.models[m]
+        found = assignment >= 0
+        rot, pos, err = fitRigid(model.markers[found], points[assignment[found]])
+        if model.symmetric:
+            rot, pos = model.canonicalPose(rot, pos)
+        return (len(found) - found.sum(), err, m, assignment, rot, pos)
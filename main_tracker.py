@@ -1,8 +1,9 @@
 from frame import FrameMesh
 from frame_shader import FrameShader
+from preview import PreviewMesh, annotate
+from preview_shader import PreviewShader
 from volume_nii import VolumeNiiMesh
 from volume_shader import VolumeShader
-from utils import findRotMat
 from obj_shader import ObjShader
 from obj import ObjMesh
 import OpenGL.GL as gl
@@ -35,7 +36,10 @@ from pprint import pprint
 import glm
 import time
 import params
-from tracker import Tracker, full_img_width, full_img_height, fb_zoom
+from tracker import Tracker
+from pose_filter import PoseFilter
+from instruments import rotationBetween
+import instrumentation
 from time import sleep
 import glfw
 from window import Window
@@ -44,6 +48,8 @@ from window import Window
 class App:
     def __init__(self):
         self.tracker = Tracker()
+        if params.TRACKER_BACKGROUND:
+            self.tracker.startBackground()
 
         self.window = Window("Instrument Tracker", self.display)
         # context has to be initialized before any function touches opengl
@@ -61,18 +67,42 @@ class App:
         self.frame = FrameMesh(self.frame_shader)
         self.frame.uploadMeshData()
 
+        # annotated tracker frames in the fourth viewport, when enabled
+        self.preview_shader = PreviewShader()
+        self.preview_shader.compile()
+        self.preview = PreviewMesh(
+            self.preview_shader,
+            params.PREVIEW_WIDTH,
+            params.PREVIEW_WIDTH
+            * params.CAM_SENSOR_HEIGHT
+            // (2 * params.CAM_SENSOR_WIDTH),
+        )
+        self.preview.uploadMeshData()
+        self.preview_enabled = params.TRACKER_PREVIEW
+        self.preview_requested_at = 0.0
+        self.preview_shown = None
+
         self.obj_shader = ObjShader()
         self.obj_shader.compile()
         self.operating_table_obj = ObjMesh(
             "./assets/OperatingTable.obj", self.obj_shader
         )
         self.operating_table_obj.uploadMeshData()
-        self.instrument_obj = ObjMesh("./assets/instrument1.obj", self.obj_shader)
-        self.instrument_obj.uploadMeshData()
-        self.instrument_pos = [0, 1.0, 0.0]
-        self.instrument_obj.moveTo(*self.instrument_pos)
-        self.instrument_rot = [0, 0, 0]
-        self.instrument_live = False
+        # one mesh per registered instrument, keyed by name
+        self.instrument_objs = {}
+        self.instrument_live = {}
+        self.instrument_models = {}
+        for model in self.tracker.registry.models:
+            self.instrument_models[model.name] = model
+            obj = ObjMesh(model.objPath, self.obj_shader)
+            obj.uploadMeshData()
+            obj.moveTo(0, 1.0, 0.0)
+            self.instrument_objs[model.name] = obj
+            self.instrument_live[model.name] = False
+        self.instrument_pose = None
+        self.pose_filter = PoseFilter(self.tracker.registry.models)
+        self.pose_filter_enabled = params.POSE_FILTER
+        self.pipeline_latency = None
 
         self.volume_shader = VolumeShader()
         self.volume_shader.compile()
@@ -116,28 +146,73 @@ class App:
         gl.glEnable(gl.GL_DEPTH_TEST)
         gl.glEnable(gl.GL_FRAMEBUFFER_SRGB)
 
-    def updateInstrument(self):
-        instrPos, instrDir = self.tracker.getInstrCoords()
-
-        if instrPos is not None:
-            self.instrument_pos = [instrPos.x, instrPos.y, instrPos.z]
-            self.instrument_obj.moveTo(*self.instrument_pos)
-
-            instrDirOrig = glm.vec3(0, 0, 1)
-            rotMat = findRotMat(instrDirOrig, instrDir)
-            self.instrument_obj.rotationMat = rotMat
-            self.instrument_live = True
+    def updateInstruments(self):
+        if self.tracker.isBackground():
+            pose = self.tracker.getLatestPose()
+        else:
+            pose = self.tracker.trackOnce()
+
+        if pose is not None and (
+            self.instrument_pose is None or pose.seq != self.instrument_pose.seq
+        ):
+            self.instrument_pose = pose
+            self.pose_filter.update(pose.instruments, pose.frameTime)
+            latency = pose.timestamp - pose.frameTime
+            instrumentation.record("render to pose", latency)
+            if self.pipeline_latency is None:
+                self.pipeline_latency = latency
+            else:
+                self.pipeline_latency += 0.1 * (latency - self.pipeline_latency)
+
+        now = time.time()
+        if self.pose_filter_enabled:
+            # where the instruments are when this frame is on the screen
+            instruments = self.pose_filter.predict(now + params.POSE_DISPLAY_LATENCY)
+        elif pose is not None and now - pose.timestamp <= params.TRACKER_STALE_AFTER:
+            instruments = pose.instruments
         else:
-            self.instrument_live = False
+            instruments = []
+
+        for name in self.instrument_live:
+            self.instrument_live[name] = False
+        for instrument in instruments:
+            obj = self.instrument_objs[instrument.name]
+            obj.moveTo(*instrument.pos)
+            model = self.instrument_models[instrument.name]
+            if model.symmetric:
+                # the roll isn't known, only the direction is drawn
+                rot = rotationBetween(model.axis, instrument.dir)
+            else:
+                rot = instrument.rot
+            rotMat = glm.mat4(glm.mat3(*rot.T.flatten()))
+            obj.rotationMat = rotMat
+            self.instrument_live[instrument.name] = True
+
+    def updatePreview(self):
+        now = time.time()
+        if now - self.preview_requested_at >= 1 / params.PREVIEW_RATE:
+            self.tracker.requestPreview(params.PREVIEW_WIDTH)
+            self.preview_requested_at = now
+
+        preview = self.tracker.preview
+        if preview is None or preview is self.preview_shown:
+            return
+        self.preview_shown = preview
+        self.preview.update(annotate(preview, self.tracker.camera.imgWidth))
+
+    def poseAge(self, pose):
+        return time.time() - pose.timestamp
 
     def display(self):
         # gl.glClearColor(0.1, 0.15, 0.18, 1.0)
         gl.glClearColor(0.3, 0.4, 0.38, 1.0)
         self.obj_shader.renderMaterialOnly(-1)
-        self.updateInstrument()
+        self.updateInstruments()
+        # a few slices of the CT per frame until it is all uploaded
+        self.volume_obj.update()
 
-        objectsToDraw = [
-            self.instrument_obj,
+        drawStart = time.perf_counter()
+        objectsToDraw = list(self.instrument_objs.values()) + [
             self.operating_table_obj,
             self.volume_obj,
             self.grid,
@@ -176,19 +251,11 @@ class App:
             params.CAM_SENSOR_WIDTH,
             params.CAM_SENSOR_HEIGHT,
         )
-        if (img := self.tracker.last_img) is not None or True:
-            pass
-            # img = cv2.resize(
-            #     img, (params.CAM_SENSOR_WIDTH, params.CAM_SENSOR_HEIGHT)
-            # )
-            # img = np.zeros((480, 480, 3), dtype=np.uint8)
-            # gl.glDrawPixels(
-            #     params.CAM_SENSOR_WIDTH,
-            #     params.CAM_SENSOR_HEIGHT,
-            #     gl.GL_BGR,
-            #     gl.GL_UNSIGNED_BYTE,
-            #     img,
-            # )
+        if self.preview_enabled:
+            self.updatePreview()
+            gl.glDepthFunc(gl.GL_ALWAYS)
+            self.preview.draw()
+            gl.glDepthFunc(gl.GL_LESS)
 
         gl.glViewport(
             0,
@@ -199,25 +266,60 @@ class App:
         gl.glDepthFunc(gl.GL_ALWAYS)
         self.frame.draw()
         gl.glDepthFunc(gl.GL_LESS)
+        instrumentation.record("draw", time.perf_counter() - drawStart, drawStart)
 
         self.drawImGui()
 
     def drawImGui(self):
-        if imgui.begin("Debug Info"):
-
-            imgui.text("Position")
-
-            any_changed = False
-            imgui.input_float("X", -self.instrument_pos[0], step=0.1)
+        instrumentation.drawImGui()
 
-            imgui.input_float("Y", self.instrument_pos[1], step=0.1)
-
-            imgui.input_float("Z", self.instrument_pos[2], step=0.1)
+        if imgui.begin("Debug Info"):
 
-            m = self.instrument_obj.getRotationMat()
-            v = glm.vec4(0, 0, 1, 0)
-            v = m * v
-            imgui.text("X {:.3f} Y {:.3f} Z {:.3f}".format(v.x, v.y, v.z))
+            if not self.volume_obj.isReady():
+                imgui.text(
+                    "Loading CT {:.0f}%".format(100 * self.volume_obj.progress())
+                )
+
+            for name, obj in self.instrument_objs.items():
+                imgui.text(
+                    "{}{}".format(
+                        name, "" if self.instrument_live[name] else " (stale)"
+                    )
+                )
+
+                imgui.text("Position X {:.3f} Y {:.3f} Z {:.3f}".format(*obj.position))
+
+                m = obj.getRotationMat()
+                v = glm.vec4(0, 0, 1, 0)
+                v = m * v
+                imgui.text("Axis X {:.3f} Y {:.3f} Z {:.3f}".format(v.x, v.y, v.z))
+
+            pose = self.instrument_pose
+            if pose is None:
+                imgui.text("Pose age: no pose yet")
+            else:
+                imgui.text(
+                    "Pose age {:.0f} ms, frame {}".format(
+                        self.poseAge(pose) * 1000, pose.seq
+                    )
+                )
+                imgui.text(
+                    "Render to pose {:.0f} ms".format(self.pipeline_latency * 1000)
+                )
+                stream = self.tracker.stream
+                imgui.text(
+                    "Frames dropped {} of {}".format(
+                        stream.framesDropped,
+                        stream.framesReceived + stream.framesDropped,
+                    )
+                )
+
+            _, self.pose_filter_enabled = imgui.checkbox(
+                "Predict poses", self.pose_filter_enabled
+            )
+            _, self.preview_enabled = imgui.checkbox(
+                "Annotated preview", self.preview_enabled
+            )
 
             imgui.end()
 
@@ -226,6 +328,8 @@ class App:
 
     def run(self):
         self.window.run()
+        self.tracker.close()
+        instrumentation.dump(params.INSTRUMENTATION_DUMP.format("tracker"))
 
 
 if __name__ == "__main__":
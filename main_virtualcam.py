@@ -18,22 +18,60 @@ from volume_test import VolumeTestMesh
 import logging
 import glfw
 from camera_controls import CameraControls
-import multiprocessing.connection as mpc
+from frame_stream import FrameStreamServer
+from frame_stream_async import AsyncFrameStreamServer
+import instrumentation
 import time
 import threading
 import imgui
 import select
 import queue
 import params
+from frame_format import frameShape
+from pbo_readback import PboReadback
+
+# gleons are white on black, so the red channel alone is enough for gray
+READBACK_FORMATS = {
+    "float32_bgr": (gl.GL_BGR, gl.GL_FLOAT),
+    "uint8_bgr": (gl.GL_BGR, gl.GL_UNSIGNED_BYTE),
+    "uint8_gray": (gl.GL_RED, gl.GL_UNSIGNED_BYTE),
+}
+
+
+class FrameStats:
+    # exponential moving average of a duration in seconds
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.avg = None
+
+    def add(self, seconds):
+        if self.avg is None:
+            self.avg = seconds
+        else:
+            self.avg += self.alpha * (seconds - self.avg)
+
+    def reset(self):
+        self.avg = None
+
+    def ms(self):
+        return (self.avg or 0.0) * 1000
+
+    def msFps(self):
+        ms = self.ms()
+        return ms, (1000 / ms if ms else 0.0)
 
 
 class App:
     def __init__(self):
-        self.listener = mpc.Listener(("127.0.0.1", 5001), "AF_INET")
-        self.connection = None
-        self.connectionThread = None
-        self.connectionDataQueue = queue.Queue(maxsize=1)
-        self.acceptStreamConnectionInBackground()
+        fb_zoom = params.FB_ZOOM
+        self.fb_width = params.CAM_SENSOR_WIDTH * 2 * fb_zoom
+        self.fb_height = params.CAM_SENSOR_HEIGHT * fb_zoom
+
+        if params.STREAM_IO == "asyncio":
+            self.stream = AsyncFrameStreamServer(self.fb_width, self.fb_height)
+        else:
+            self.stream = FrameStreamServer(self.fb_width, self.fb_height)
+        self.stream.acceptInBackground()
 
         self.window = Window("Virtual Stereo Camera", self.display)
         # context has to be initialized before any function touches opengl
@@ -93,10 +131,6 @@ class App:
         gl.glEnable(gl.GL_DEPTH_TEST)
         gl.glEnable(gl.GL_FRAMEBUFFER_SRGB)
 
-        fb_zoom = params.FB_ZOOM
-        self.fb_width = params.CAM_SENSOR_WIDTH * 2 * fb_zoom
-        self.fb_height = params.CAM_SENSOR_HEIGHT * fb_zoom
-
         self.rb = gl.glGenRenderbuffers(1)  # type: ignore
         gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.rb)
         gl.glRenderbufferStorage(
@@ -107,6 +141,14 @@ class App:
         )
         gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, 0)
 
+        self.readbackMode = params.READBACK_MODE
+        self.pbo = PboReadback(self.fb_width, self.fb_height, params.READBACK_PBOS)
+        self.readbackStats = FrameStats()
+        self.frameStats = FrameStats()
+        # numbers the frames rendered for the stream
+        self.renderSeq = 0
+        self.lastFrameTime = None
+
         self.fb = gl.glGenFramebuffers(1)  # type: ignore
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fb)
         gl.glFramebufferRenderbuffer(
@@ -118,8 +160,16 @@ class App:
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
     def display(self):
+        now = time.perf_counter()
+        if self.lastFrameTime is not None:
+            self.frameStats.add(now - self.lastFrameTime)
+        self.lastFrameTime = now
+
+        # a few slices of the CT per frame until it is all uploaded
+        self.volume_obj.update()
         self.drawGleonsStereo()
 
+        drawStart = time.perf_counter()
         if self.renderGleonsOnly:
             gl.glClearColor(0.0, 0.0, 0.0, 1.0)
             self.obj_shader.renderMaterialOnly(1)
@@ -161,12 +211,20 @@ class App:
             self.camera.setAllUniforms()
             for obj in objectsToDraw:
                 obj.draw()
+        instrumentation.record("draw", time.perf_counter() - drawStart, drawStart)
 
         self.drawImGui()
 
     def drawImGui(self):
+        instrumentation.drawImGui()
+
         if imgui.begin("Instrument Controls"):
 
+            if not self.volume_obj.isReady():
+                imgui.text(
+                    "Loading CT {:.0f}%".format(100 * self.volume_obj.progress())
+                )
+
             imgui.text("Position")
 
             any_changed = False
@@ -215,7 +273,22 @@ class App:
 
             imgui.end()
 
+        if imgui.begin("Readback"):
+            imgui.text("Mode {} (P to toggle)".format(self.readbackMode))
+            imgui.text("Frame {:.2f} ms ({:.1f} fps)".format(*self.frameStats.msFps()))
+            imgui.text("Readback {:.2f} ms".format(self.readbackStats.ms()))
+            for (host, port), transport, sent, dropped in self.stream.subscriberStats():
+                imgui.text(
+                    "{}:{} {} sent {} dropped {}".format(
+                        host, port, transport, sent, dropped
+                    )
+                )
+            imgui.end()
+
     def drawGleonsStereo(self):
+        self.renderSeq += 1
+        stamp = (self.renderSeq, time.time())
+        renderStart = time.perf_counter()
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fb)
 
         gl.glClearColor(0.0, 0.0, 0.0, 1.0)
@@ -240,45 +313,46 @@ class App:
         for obj in objectsToDraw:
             obj.draw()
 
-        arr = gl.glReadPixelsf(
-            0,
-            0,
-            self.fb_width,
-            self.fb_height,
-            gl.GL_BGR,
-        )
+        fmt = self.stream.format
+        glFormat, glType = READBACK_FORMATS[fmt.name]
 
-        # without this, a line seem to be wrapped into two lines and cause weird
-        # interlacing like effects
-        arr = arr.reshape((self.fb_height, self.fb_width, 3))
+        start = time.perf_counter()
+        instrumentation.record("render", start - renderStart, renderStart)
+        if self.readbackMode == "pbo":
+            arr = self.pbo.read(
+                fmt, glFormat, glType, self.stream.hasSubscribers(), stamp
+            )
+            stamp = self.pbo.readStamp
+        elif not self.stream.hasSubscribers():
+            # nobody to send it to
+            arr = None
+        else:
+            gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+            arr = gl.glReadPixels(
+                0,
+                0,
+                self.fb_width,
+                self.fb_height,
+                glFormat,
+                glType,
+                outputType=None,
+            )
 
-        # Because glReadPixels considers (0,0) as bottom-left corner
-        arr = np.flip(arr, 0)
+            # without this, a line seem to be wrapped into two lines and cause
+            # weird interlacing like effects
+            arr = np.asarray(arr, dtype=fmt.dtype).reshape(
+                frameShape(fmt, self.fb_width, self.fb_height)
+            )
+        self.readbackStats.add(time.perf_counter() - start)
+        instrumentation.record("readback", time.perf_counter() - start, start)
 
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
-        if self.connectionDataQueue.full():
-            return
-
-        self.connectionDataQueue.put_nowait(arr)
-
-    def acceptStreamConnectionInBackground(self):
-        if self.connection is not None:
-            return
-
-        def start():
-            while True:
-                self.connection = self.listener.accept()
-                while True:
-                    arr = self.connectionDataQueue.get()
-                    try:
-                        self.connection.send_bytes(arr.tobytes())
-                    except (ConnectionResetError, BrokenPipeError):
-                        self.connection = None
-                        break
-
-        self.connectionThread = threading.Thread(target=start, daemon=True)
-        self.connectionThread.start()
+        # Frames stay bottom-up as glReadPixels returns them; the stream
+        # announces the origin and the tracker flips in its coordinates.
+        if arr is not None:
+            with instrumentation.span("enqueue"):
+                self.stream.submit(arr, *stamp)
 
     def keyboard(self, key, action, mods):
         if key == glfw.KEY_TAB and action == glfw.PRESS:
@@ -287,9 +361,15 @@ class App:
         if key == glfw.KEY_BACKSPACE and action == glfw.PRESS:
             self.stereoCamActive = not self.stereoCamActive
 
+        if key == glfw.KEY_P and action == glfw.PRESS:
+            self.readbackMode = "sync" if self.readbackMode == "pbo" else "pbo"
+            self.frameStats.reset()
+            self.readbackStats.reset()
+
     def run(self):
         self.window.run()
-        self.listener.close()
+        self.stream.close()
+        instrumentation.dump(params.INSTRUMENTATION_DUMP.format("virtualcam"))
 
 
 if __name__ == "__main__":
@@ -6,3 +6,84 @@ CAM_X_DELTA = 0.58
 CAM_Y = 1.7128
 CAM_Z = -2
 CAM_POSE = (0, -0.7, 1)
+
+# frame stream between main_virtualcam.py and the tracker
+STREAM_TRANSPORT = "shm"  # "shm" or "socket"
+# subscribers that can map the ring at once, more fall back to the socket
+SHM_RING_READERS = 4
+# more than SHM_RING_READERS, every reader can hold a slot while the writer
+# fills another one
+SHM_RING_SLOTS = 6
+STREAM_IO = "threads"  # "threads" or "asyncio", see frame_stream_async.py
+STREAM_HEARTBEAT = 0.5  # seconds, sent by the server while there are no frames
+STREAM_TIMEOUT = 2.0  # seconds of silence before a client reconnects
+STREAM_RECONNECT_DELAY = (0.05, 2.0)  # backoff between attempts, first and max
+STREAM_FORMAT = "uint8_gray"  # "float32_bgr", "uint8_bgr" or "uint8_gray"
+
+# how main_virtualcam.py reads the stereo framebuffer back
+READBACK_MODE = "pbo"  # "pbo" or "sync"
+READBACK_PBOS = 2
+
+# marker detection in tracker.py
+TRACKER_DETECTOR = "blob"  # "blob" or "hough"
+BLOB_THRESHOLD = 127
+BLOB_MIN_AREA = 4  # pixels
+# epipolar matching of left and right markers
+STEREO_ROW_TOLERANCE = 2.0  # sensor pixels
+STEREO_MIN_DEPTH = 0.2
+STEREO_MAX_DEPTH = 20.0
+# instruments to track, (name, OBJ file); the markers are taken from the
+# faces with INSTRUMENT_MARKER_MATERIAL
+INSTRUMENTS = [("instrument1", "./assets/instrument1.obj")]
+INSTRUMENT_MARKER_MATERIAL = "White"
+INSTRUMENT_DISTANCE_TOLERANCE = 0.01
+# fewest visible markers an instrument is identified from
+INSTRUMENT_MIN_MARKERS = 3
+# pool for the left and right halves: "thread", "process" or "none"
+TRACKER_POOL = "thread"
+
+# search only small windows around the predicted marker positions
+TRACKER_ROI = True
+ROI_RADIUS_SCALE = 2.0  # window half size in marker radii
+ROI_MARGIN = 8  # pixels
+
+# run the tracker on a worker thread in main_tracker.py
+TRACKER_BACKGROUND = True
+TRACKER_STALE_AFTER = 0.25  # seconds
+
+# Kalman filter between the tracker and the scene in main_tracker.py
+POSE_FILTER = True
+POSE_FILTER_POS_ACCEL = 2.0  # expected acceleration, units / s^2
+POSE_FILTER_DIR_ACCEL = 20.0  # 1 / s^2
+POSE_FILTER_POS_NOISE = 0.002  # measurement noise, units
+POSE_FILTER_DIR_NOISE = 0.02
+POSE_FILTER_COAST = 0.25  # seconds to bridge missed detections
+# from the end of display() until the frame is on the screen
+POSE_DISPLAY_LATENCY = 0.016  # seconds
+
+# timing spans, see instrumentation.py
+INSTRUMENTATION = True
+INSTRUMENTATION_SAMPLES = 1024  # per span
+INSTRUMENTATION_DUMP = "timings_{}.csv"  # written on exit, {} is the app
+
+# recordings of the frame stream, see recording.py
+RECORDING_CHUNK_FRAMES = 256
+
+# synthetic frames, see synthetic.py
+SYNTHETIC_MARKER_RADIUS = 0.012  # the marker spheres of instrument1.obj
+
+# annotated tracker frames in the fourth viewport of main_tracker.py
+TRACKER_PREVIEW = False
+PREVIEW_RATE = 5  # frames per second
+PREVIEW_WIDTH = CAM_SENSOR_WIDTH  # pixels, both halves
+
+# CT volume textures, see volume_format.py
+VOLUME_TEXTURE_FORMAT = "auto"  # "auto" picks by value range, or e.g. "r32f"
+# pad every axis to a power of two, only for drivers without NPOT textures
+VOLUME_POT_PADDING = False
+# converted volumes are kept here, see volume_cache.py
+VOLUME_CACHE = True
+VOLUME_CACHE_DIR = ".volume_cache"
+# decode the CT on a worker thread and upload it in slabs across frames
+VOLUME_BACKGROUND_LOAD = True
+VOLUME_UPLOAD_BUDGET_MS = 4.0  # per frame
@@ -0,0 +1,79 @@
+import OpenGL.GL as gl
+import numpy as np
+import ctypes
+from frame_format import frameShape, frameBytes
+
+
+class PboReadback:
+    """Asynchronous glReadPixels through a ring of pixel pack buffers.
+
+    Each call to read() starts a transfer of the current framebuffer into one
+    PBO and maps the oldest one, so frame N is copied out while the GPU works
+    on frame N + count - 1. Frames stay bottom-up as GL delivers them.
+    """
+
+    def __init__(self, width, height, count=2):
+        self.width = width
+        self.height = height
+        self.count = count
+        self.pbos = list(gl.glGenBuffers(count))  # type: ignore
+        self.pending = [None] * count  # format of the frame in each PBO
+        self.stamps = [None] * count
+        # stamp passed along with the frame read() last returned
+        self.readStamp = None
+        self.idx = 0
+        self.fmt = None
+
+    def _allocate(self, fmt):
+        nbytes = frameBytes(fmt, self.width, self.height)
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, nbytes, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.pending = [None] * self.count
+        self.fmt = fmt
+
+    def read(self, fmt, glFormat, glType, wanted=True, stamp=None):
+        """Queues a read of the bound framebuffer and returns the frame queued
+        count - 1 calls ago, or None if there is none yet or wanted is False.
+        The stamp given with that frame is left in readStamp.
+        """
+        if fmt != self.fmt:
+            self._allocate(fmt)
+
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[self.idx])
+        gl.glReadPixels(
+            0, 0, self.width, self.height, glFormat, glType, ctypes.c_void_p(0)
+        )
+        self.pending[self.idx] = fmt
+        self.stamps[self.idx] = stamp
+        self.idx = (self.idx + 1) % self.count
+
+        arr = None
+        oldest = self.idx
+        if wanted and self.pending[oldest] == fmt:
+            nbytes = frameBytes(fmt, self.width, self.height)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[oldest])
+            ptr = gl.glMapBufferRange(
+                gl.GL_PIXEL_PACK_BUFFER, 0, nbytes, gl.GL_MAP_READ_BIT
+            )
+            if ptr:
+                mapped = np.ctypeslib.as_array(
+                    (ctypes.c_ubyte * nbytes).from_address(ptr)  # type: ignore
+                )
+                arr = mapped.view(fmt.dtype).reshape(
+                    frameShape(fmt, self.width, self.height)
+                )
+                # the mapping is gone after unmap, so this is the one copy
+                arr = arr.copy()
+                gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+                self.readStamp = self.stamps[oldest]
+            self.pending[oldest] = None
+
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        return arr
+
+    def delete(self):
+        gl.glDeleteBuffers(self.count, self.pbos)
+        self.pbos = []
@@ -0,0 +1,127 @@
+from collections import namedtuple
+import numpy as np
+import params
+from instruments import rotationBetween
+
+# pose of an instrument predicted for some time, age is how long ago it was
+# last measured
+FilteredPose = namedtuple("FilteredPose", ["name", "pos", "rot", "dir", "age"])
+
+# filtered channels per instrument: position xyz and direction xyz
+CHANNELS = 6
+
+
+class PoseFilter:
+    """Constant velocity Kalman filter over the poses of a set of instruments.
+
+    Every coordinate of the position and direction of every instrument is
+    filtered on its own with a (value, rate) state, all of them at once as
+    arrays. update() folds in the instruments the tracker found in a frame,
+    at the time the frame was taken; predict() extrapolates to any later
+    time, so the scene can show where the instruments are when the frame
+    hits the screen rather than where they were when it was rendered.
+    Instruments missing from a frame keep moving on their velocity for up
+    to params.POSE_FILTER_COAST seconds.
+    """
+
+    def __init__(self, models):
+        self.models = list(models)
+        self.index = {model.name: i for i, model in enumerate(self.models)}
+        count = len(self.models)
+
+        self.x = np.zeros((count, CHANNELS, 2))
+        self.P = np.zeros((count, CHANNELS, 2, 2))
+        self.t = np.full(count, -np.inf)
+        # last measured rotation, carries the roll about the direction
+        self.rot = np.tile(np.eye(3), (count, 1, 1))
+
+        self.q = np.repeat(
+            [params.POSE_FILTER_POS_ACCEL**2, params.POSE_FILTER_DIR_ACCEL**2], 3
+        )
+        self.r = np.repeat(
+            [params.POSE_FILTER_POS_NOISE**2, params.POSE_FILTER_DIR_NOISE**2], 3
+        )
+        self.coast = params.POSE_FILTER_COAST
+
+    def reset(self):
+        self.t[:] = -np.inf
+
+    def _propagate(self, i, dt):
+        # x' = F x, P' = F P F^T + Q for F = [[1, dt], [0, 1]] and white noise
+        # acceleration, dt per instrument
+        dt = dt[:, None]
+        x = self.x[i]
+        P = self.P[i]
+        x[..., 0] += dt * x[..., 1]
+
+        p00, p01, p11 = P[..., 0, 0], P[..., 0, 1], P[..., 1, 1]
+        q = self.q
+        P[..., 0, 0], P[..., 0, 1], P[..., 1, 1] = (
+            p00 + dt * (2 * p01 + dt * p11) + q * dt**4 / 4,
+            p01 + dt * p11 + q * dt**3 / 2,
+            p11 + q * dt**2,
+        )
+        P[..., 1, 0] = P[..., 0, 1]
+        self.x[i] = x
+        self.P[i] = P
+
+    def update(self, instruments, t):
+        """Folds in the InstrumentPoses found in a frame taken at time t."""
+        if not instruments:
+            return
+        i = np.array([self.index[instrument.name] for instrument in instruments])
+        z = np.array(
+            [
+                np.concatenate([instrument.pos, instrument.dir])
+                for instrument in instruments
+            ]
+        )
+        self.rot[i] = [instrument.rot for instrument in instruments]
+
+        # instruments seen for the first time or after they were lost start
+        # at rest on the measurement
+        fresh = t - self.t[i] > self.coast
+        if fresh.any():
+            f = i[fresh]
+            self.x[f, :, 0] = z[fresh]
+            self.x[f, :, 1] = 0
+            self.P[f] = 0
+            self.P[f, :, 0, 0] = self.r
+            # any velocity the instrument could have picked up while lost
+            self.P[f, :, 1, 1] = self.q * self.coast**2
+            self.t[f] = t
+        i, z = i[~fresh], z[~fresh]
+        if len(i) == 0:
+            return
+
+        # frames arrive in order, but don't run the model backwards
+        self._propagate(i, np.maximum(t - self.t[i], 0))
+        self.t[i] = np.maximum(self.t[i], t)
+
+        x = self.x[i]
+        P = self.P[i]
+        innovation = z - x[..., 0]
+        gain = P[..., :, 0] / (P[..., 0, 0] + self.r)[..., None]
+        x += gain * innovation[..., None]
+        P -= gain[..., :, None] * P[..., None, 0, :]
+        self.x[i] = x
+        self.P[i] = P
+
+    def predict(self, t):
+        """FilteredPose of every instrument still tracked at time t."""
+        dt = t - self.t
+        live = np.flatnonzero(dt <= self.coast)
+        values = (
+            self.x[live, :, 0] + np.maximum(dt[live], 0)[:, None] * self.x[live, :, 1]
+        )
+
+        poses = []
+        for i, value in zip(live, values):
+            pos = value[:3]
+            dir = value[3:] / np.linalg.norm(value[3:])
+            # turn the last measured rotation so its axis follows the filtered
+            # direction
+            measured = self.rot[i] @ self.models[i].axis
+            rot = rotationBetween(measured, dir) @ self.rot[i]
+            poses.append(FilteredPose(self.models[i].name, pos, rot, dir, dt[i]))
+        return poses
@@ -0,0 +1,149 @@
+import OpenGL.GL as gl
+import numpy as np
+import ctypes
+import cv2
+
+
+def annotate(preview, imgWidth):
+    """BGR copy of a tracker Preview with the detected circles drawn in."""
+    img = cv2.cvtColor(preview.img, cv2.COLOR_GRAY2BGR)
+    for isRight, sideCircles in enumerate(preview.detected):
+        for a, b, r in sideCircles:
+            a += isRight * imgWidth
+            a, b, r = np.around(np.array((a, b, r)) * preview.scale).astype(int)
+
+            # Draw the circumference of the circle, just outside the marker
+            # which is only a few pixels across at this size.
+            cv2.circle(img, (a, b), r + 2, (0, 255, 0), 1)
+
+            # Draw a small circle (of radius 1) to show the center.
+            cv2.circle(img, (a, b), 1, (0, 0, 255), -1)
+    return img
+
+
+class PreviewMesh:
+    """Textured quad showing the annotated stereo frame.
+
+    The texture is allocated once and refilled with glTexSubImage2D. Frames
+    arrive bottom-up, which is the row order GL expects.
+    """
+
+    def __init__(self, shader, width, height):
+        self.shader = shader
+        self.width = width
+        self.height = height
+        self.texo = None
+
+        # keep the aspect ratio of the frame in a square viewport
+        h = height / width
+        self.vertices = [
+            (-1, -h, 0, 0, 0),
+            (1, -h, 0, 1, 0),
+            (-1, h, 0, 0, 1),
+            (1, h, 0, 1, 1),
+        ]
+        self.faces = [(0, 1, 2), (1, 2, 3)]
+
+    def uploadMeshData(self):
+        vbo = gl.glGenBuffers(1)  # type: ignore
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo)
+        vbo_data = np.array(self.vertices, dtype=(np.float32, 5))
+        gl.glBufferData(
+            gl.GL_ARRAY_BUFFER, vbo_data.nbytes, vbo_data, gl.GL_STATIC_DRAW
+        )
+
+        # create EBO, upload data
+        ebo = gl.glGenBuffers(1)  # type: ignore
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, ebo)
+        ebo_data = np.array(self.faces, dtype=(np.uint32, 3))
+        gl.glBufferData(
+            gl.GL_ELEMENT_ARRAY_BUFFER,
+            ebo_data.nbytes,
+            ebo_data,
+            gl.GL_STATIC_DRAW,
+        )
+
+        # create VAO
+        vao = gl.glGenVertexArrays(1)  # type: ignore
+        gl.glBindVertexArray(vao)
+
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo)
+
+        positionLoc = self.shader.getPositionAttribLoc()
+        gl.glEnableVertexArrayAttrib(vao, positionLoc)
+        gl.glVertexAttribPointer(
+            positionLoc,
+            3,
+            gl.GL_FLOAT,
+            False,
+            vbo_data.strides[0],
+            ctypes.c_void_p(0),
+        )
+        uvLoc = self.shader.getUVAttribLoc()
+        gl.glEnableVertexArrayAttrib(vao, uvLoc)
+        gl.glVertexAttribPointer(
+            uvLoc,
+            2,
+            gl.GL_FLOAT,
+            False,
+            vbo_data.strides[0],
+            ctypes.c_void_p(3 * 4),
+        )
+        # attach EBO to VAO
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, ebo)
+
+        self.vao = vao
+        gl.glBindVertexArray(0)
+
+        self.texo = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texo)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glTexImage2D(
+            gl.GL_TEXTURE_2D,
+            0,
+            gl.GL_RGB8,
+            self.width,
+            self.height,
+            0,
+            gl.GL_BGR,
+            gl.GL_UNSIGNED_BYTE,
+            None,
+        )
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def update(self, img):
+        """Streams a (height, width, 3) uint8 BGR image into the texture."""
+        h, w = img.shape[:2]
+        h, w = min(h, self.height), min(w, self.width)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texo)
+        gl.glTexSubImage2D(
+            gl.GL_TEXTURE_2D,
+            0,
+            0,
+            0,
+            w,
+            h,
+            gl.GL_BGR,
+            gl.GL_UNSIGNED_BYTE,
+            np.ascontiguousarray(img[:h, :w]),
+        )
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        self.shader.use()
+        self.shader.setTexIdx(0)
+        gl.glBindVertexArray(self.vao)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texo)
+        gl.glDrawElements(
+            gl.GL_TRIANGLES,
+            len(self.faces) * 3,
+            gl.GL_UNSIGNED_INT,
+            ctypes.c_void_p(0),
+        )  # type: ignore
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glBindVertexArray(0)
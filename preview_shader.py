@@ -0,0 +1,35 @@
+import OpenGL.GL as gl
+from shader import Shader
+
+
+class PreviewShader(Shader):
+    def __init__(self):
+        vertexCode = """#version 330 core
+        in vec3 position;
+        in vec2 uv;
+        out vec2 fuv;
+
+        void main() {
+            fuv = uv;
+            gl_Position = vec4(position.xy, -1.0, 1.0);
+        }
+        """
+
+        fragmentCode = """#version 330 core
+        uniform sampler2D tex;
+        in vec2 fuv;
+
+        void main() {
+            gl_FragColor = vec4(texture(tex, fuv).rgb, 1);
+        }
+        """
+        super().__init__(vertexCode, fragmentCode)
+
+    def getPositionAttribLoc(self):
+        return self._getAttribLocation("position")
+
+    def getUVAttribLoc(self):
+        return self._getAttribLocation("uv")
+
+    def setTexIdx(self, i):
+        self._setInt("tex", i)
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import params
+from frame_stream import FrameStreamClient, FrameStreamServer
+from frame_header import FrameHeader, headerShape
+from frame_format import findFormat
+
+# A recording is a directory with
+#   meta.json          frame size, dtype, channels, origin, chunk size
+#   index.bin          one INDEX_DTYPE record per frame, appended as they come
+#   frames_NNNNN.npy   chunks of up to chunk frames each, memory mapped
+# Frames are stored as they arrived on the stream, rows in the stream origin.
+
+INDEX_DTYPE = np.dtype([("seq", "<i8"), ("timestamp", "<f8")])
+
+
+def _chunkPath(path, chunk):
+    return os.path.join(path, "frames_{:05d}.npy".format(chunk))
+
+
+class RecordingWriter:
+    def __init__(self, path, chunkFrames=None):
+        self.path = path
+        self.chunkFrames = chunkFrames or params.RECORDING_CHUNK_FRAMES
+        self.meta = None
+        self.chunk = None
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+        self.index = open(os.path.join(path, "index.bin"), "wb")
+
+    def _start(self, header):
+        self.meta = {
+            "width": header.width,
+            "height": header.height,
+            "dtype": header.dtype.str,
+            "channels": header.channels,
+            "origin": header.origin,
+            "chunk": self.chunkFrames,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump(self.meta, file)
+
+    def append(self, header, frame):
+        if self.meta is None:
+            self._start(header)
+        elif (header.width, header.height, header.dtype.str) != (
+            self.meta["width"],
+            self.meta["height"],
+            self.meta["dtype"],
+        ):
+            raise ValueError("frame format changed during the recording")
+
+        row = self.count % self.chunkFrames
+        if row == 0:
+            if self.chunk is not None:
+                self.chunk.flush()
+            self.chunk = np.lib.format.open_memmap(
+                _chunkPath(self.path, self.count // self.chunkFrames),
+                mode="w+",
+                dtype=header.dtype,
+                shape=(self.chunkFrames,) + headerShape(header),
+            )
+        self.chunk[row] = frame  # type: ignore
+        np.array([(header.seq, header.timestamp)], INDEX_DTYPE).tofile(self.index)
+        self.count += 1
+
+    def close(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+        self.index.close()
+
+
+class Recording:
+    """Read-only access to a recording, frames are memory mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        self.index = np.fromfile(os.path.join(path, "index.bin"), INDEX_DTYPE)
+        self.chunkFrames = self.meta["chunk"]
+        self.width = self.meta["width"]
+        self.height = self.meta["height"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.channels = self.meta["channels"]
+        self.origin = self.meta["origin"]
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def chunk(self, c):
+        if c not in self.chunks:
+            self.chunks[c] = np.load(_chunkPath(self.path, c), mmap_mode="r")
+        return self.chunks[c]
+
+    def frame(self, i):
+        return self.chunk(i // self.chunkFrames)[i % self.chunkFrames]
+
+    def header(self, i):
+        seq, timestamp = self.index[i]
+        return FrameHeader(
+            int(seq),
+            float(timestamp),
+            self.width,
+            self.height,
+            self.dtype,
+            self.channels,
+            self.origin,
+            0,
+            -1,
+        )
+
+    def frames(self, start=0, stop=None):
+        """(header, frame) for frames start to stop."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.header(i), self.frame(i)
+
+
+def record(path, frames=None):
+    """Taps the frame stream of main_virtualcam.py into a recording."""
+    client = FrameStreamClient()
+    writer = RecordingWriter(path)
+    try:
+        while frames is None or writer.count < frames:
+            frame = client.recvFrame()
+            if frame is None:
+                if not client.isConnected():
+                    time.sleep(0.1)
+                continue
+            writer.append(client.header, frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        client.close()
+    return writer.count, client.framesDropped
+
+
+def replay(path, speed=1.0, loop=False):
+    """Serves a recording on the frame stream port in place of
+    main_virtualcam.py. speed scales the recorded frame times, None sends
+    frames as fast as the client takes them.
+
+    Every frame reaches every client: they are served over the socket even
+    when they ask for shm, whose clients skip ahead to the newest frame.
+    """
+    recording = Recording(path)
+    server = FrameStreamServer(
+        recording.width,
+        recording.height,
+        findFormat(recording.dtype, recording.channels),
+        shm=False,
+    )
+    server.acceptInBackground()
+    first = recording.index["timestamp"][0]
+    # seq has to keep growing when the recording starts over
+    seqOffset = 0
+    try:
+        while not server.hasSubscribers():
+            time.sleep(0.01)
+        while True:
+            start = time.time()
+            for header, frame in recording.frames():
+                if speed is not None:
+                    delay = start + (header.timestamp - first) / speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                # no frame is skipped, the slowest subscriber sets the pace
+                while not server.canSubmit():
+                    time.sleep(0.001)
+                server.submit(frame, header.seq + seqOffset, time.time())
+            if not loop:
+                break
+            seqOffset += int(recording.index["seq"][-1])
+        # the last frame is sent before the server goes
+        while server.hasSubscribers() and not server.canSubmit():
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or replay the frame stream")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="record main_virtualcam.py")
+    rec.add_argument("path")
+    rec.add_argument("--frames", type=int, help="stop after this many frames")
+    rep = sub.add_parser("replay", help="serve a recording to the tracker")
+    rep.add_argument("path")
+    rep.add_argument(
+        "--speed", default="1", help="factor on the recorded frame rate, or max"
+    )
+    rep.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        count, dropped = record(args.path, args.frames)
+        print("recorded {} frames, {} dropped on the way".format(count, dropped))
+    else:
+        replay(args.path, None if args.speed == "max" else float(args.speed), args.loop)
@@ -0,0 +1,144 @@
+import sys
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# Header layout (int64 each):
+#   [0]                       sequence number of the last completed write
+#   [1 : 1+readers]           slot currently held by each reader (-1 if none)
+#   [1+readers : +slots]      sequence number stored in each slot (0 while
+#                             being written)
+HEADER_LAST_SEQ = 0
+HEADER_HELD_SLOTS = 1
+
+SLOT_ALIGN = 64
+
+
+def _align(n):
+    return (n + SLOT_ALIGN - 1) // SLOT_ALIGN * SLOT_ALIGN
+
+
+class ShmRing:
+    """Fixed ring of frame slots in shared memory.
+
+    A single writer fills the slots round robin and up to readers readers map
+    them in place, each reader with its own index. The writer never overwrites
+    a slot a reader holds, so a frame obtained with view() stays valid until
+    that reader's next view() or release(). There have to be more slots than
+    readers.
+    """
+
+    def __init__(self, shm, slots, shape, dtype, owner, readers=1, reader=0):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.readers = readers
+        # index of this reader, views are held under it
+        self.reader = reader
+
+        self.frameBytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.slotStride = _align(self.frameBytes)
+        headerBytes = _align((HEADER_HELD_SLOTS + readers + slots) * 8)
+
+        self.header = np.ndarray(
+            (HEADER_HELD_SLOTS + readers + slots,), dtype=np.int64, buffer=shm.buf
+        )
+        self.held = self.header[HEADER_HELD_SLOTS : HEADER_HELD_SLOTS + readers]
+        self.slotSeqs = self.header[HEADER_HELD_SLOTS + readers :]
+        self.frames = [
+            np.ndarray(
+                self.shape,
+                dtype=self.dtype,
+                buffer=shm.buf,
+                offset=headerBytes + i * self.slotStride,
+            )
+            for i in range(slots)
+        ]
+        self.lastSlot = -1
+
+    @staticmethod
+    def requiredSize(slots, shape, dtype, readers=1):
+        frameBytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        headerBytes = _align((HEADER_HELD_SLOTS + readers + slots) * 8)
+        return headerBytes + slots * _align(frameBytes)
+
+    @classmethod
+    def create(cls, slots, shape, dtype, readers=1):
+        if slots <= readers:
+            raise ValueError("a ring needs more slots than readers")
+        size = cls.requiredSize(slots, shape, dtype, readers)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        ring = cls(shm, slots, shape, dtype, owner=True, readers=readers)
+        ring.header[:] = 0
+        ring.held[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots, shape, dtype, readers=1, reader=0):
+        shm = shared_memory.SharedMemory(name=name)
+        # The resource tracker would otherwise unlink the segment when the
+        # reader exits, pulling it out from under the writer.
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+        return cls(
+            shm, slots, shape, dtype, owner=False, readers=readers, reader=reader
+        )
+
+    def name(self):
+        return self.shm.name
+
+    def write(self, arr, seq=None):
+        """Stores a frame, seq must grow with every write and defaults to
+        the next number. Returns (seq, slot) for view()."""
+        if seq is None:
+            seq = int(self.header[HEADER_LAST_SEQ]) + 1
+
+        slot = self.lastSlot
+        while True:
+            slot = (slot + 1) % self.slots
+            if slot in self.held.tolist():
+                continue
+            old = self.slotSeqs[slot]
+            self.slotSeqs[slot] = 0
+            # A reader claims a slot before it checks the slot's seq, so one
+            # that claimed it meanwhile either sees the 0 or is seen here.
+            if slot not in self.held.tolist():
+                break
+            # held after all, the old frame stays readable
+            self.slotSeqs[slot] = old
+
+        self.frames[slot][...] = arr
+        self.slotSeqs[slot] = seq
+        self.header[HEADER_LAST_SEQ] = seq
+        self.lastSlot = slot
+        return seq, slot
+
+    def view(self, seq, slot):
+        self.held[self.reader] = slot
+        if self.slotSeqs[slot] != seq:
+            # overwritten before we got to it
+            self.release()
+            return None
+        frame = self.frames[slot].view()
+        frame.flags.writeable = False
+        return frame
+
+    def release(self, reader=None):
+        """Lets the writer reuse the slot held by reader, this reader by
+        default. The writer releases readers that went away."""
+        self.held[self.reader if reader is None else reader] = -1
+
+    def close(self):
+        """Unmaps the ring. Raises BufferError while a frame from view() or a
+        view of one is still referenced, reading it after the unmap would
+        crash the process."""
+        # every view of a slot has the slot's array as its base
+        if any(sys.getrefcount(self.frames[i]) > 2 for i in range(len(self.frames))):
+            raise BufferError("frames of the ring are still referenced")
+        self.header = None
+        self.held = None
+        self.slotSeqs = None
+        self.frames = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,188 @@
+import argparse
+import os
+import numpy as np
+import params
+import camera_model
+from frame_header import FrameHeader
+from instruments import loadMarkers
+
+# Stereo frames like the ones main_virtualcam.py streams, made with NumPy
+# alone: markers of a rigid instrument are projected through the tracker's
+# camera model and drawn as anti-aliased white discs on black, for many
+# frames at once, with the true poses alongside. Frames are single channel
+# uint8 and bottom-up, as on the stream.
+
+
+def project(camera, points):
+    """Centered image coordinates (xL, xR, y) of world points (..., 3),
+    the inverse of triangulation.triangulate()."""
+    c = (np.asarray(points, dtype=np.float64) - camera.offset) @ camera.rotation
+    scale = c[..., 2] / camera.focalLength
+    half = camera.camXDelta / (2 * scale)
+    x = c[..., 0] / scale
+    return x + half, x - half, c[..., 1] / scale
+
+
+def rotationXYZ(ax, ay, az):
+    """Rotation matrices (..., 3, 3) for rotations about x, then y, then z."""
+    ax, ay, az = np.broadcast_arrays(ax, ay, az)
+    cx, sx, cy, sy, cz, sz = (
+        np.cos(ax),
+        np.sin(ax),
+        np.cos(ay),
+        np.sin(ay),
+        np.cos(az),
+        np.sin(az),
+    )
+    one, zero = np.ones_like(ax), np.zeros_like(ax)
+    rx = np.stack([one, zero, zero, zero, cx, -sx, zero, sx, cx], -1)
+    ry = np.stack([cy, zero, sy, zero, one, zero, -sy, zero, cy], -1)
+    rz = np.stack([cz, -sz, zero, sz, cz, zero, zero, zero, one], -1)
+    shape = ax.shape + (3, 3)
+    return rz.reshape(shape) @ ry.reshape(shape) @ rx.reshape(shape)
+
+
+def trajectory(times, center=(0.0, 1.0, 0.3), amplitude=0.15):
+    """Scripted instrument motion, positions (F, 3) and rotations (F, 3, 3)."""
+    t = np.asarray(times, dtype=np.float64)
+    pos = np.stack(
+        [np.sin(0.7 * t), 0.5 * np.sin(1.1 * t), 0.5 * np.sin(0.5 * t + 1)], -1
+    )
+    pos = np.asarray(center) + amplitude * pos
+    # the marker plane is tilted towards the cameras so the markers stay
+    # apart in both images
+    rot = rotationXYZ(
+        -1.2 + 0.3 * np.sin(0.9 * t), 0.5 * np.sin(0.4 * t), 0.2 * np.sin(0.3 * t)
+    )
+    return pos, rot
+
+
+def ringMarkers(count, radius=0.1):
+    """count markers spread over a disc in the xz plane, the marker plane of
+    instrument1.obj."""
+    k = np.arange(count)
+    # sunflower: golden angle steps, evenly spaced and without symmetries
+    angle = k * np.pi * (3 - np.sqrt(5))
+    r = radius * np.sqrt((k + 0.5) / count)
+    return np.stack([r * np.cos(angle), np.zeros(count), r * np.sin(angle)], -1)
+
+
+class SyntheticStereo:
+    def __init__(self, camera=None, markers=None, markerRadius=None):
+        self.camera = camera or camera_model.default
+        if markers is None:
+            markers = loadMarkers(
+                params.INSTRUMENTS[0][1], params.INSTRUMENT_MARKER_MATERIAL
+            )
+        self.markers = np.asarray(markers, dtype=np.float64)
+        self.markerRadius = markerRadius or params.SYNTHETIC_MARKER_RADIUS
+        self.width = int(self.camera.imgWidth)
+        self.height = int(self.camera.imgHeight)
+
+    def points(self, pos, rot):
+        """World marker positions (F, N, 3) for poses pos (F, 3), rot (F, 3, 3)."""
+        return self.markers @ np.swapaxes(rot, -1, -2) + pos[:, None, :]
+
+    def render(self, pos, rot, noise=0.0, rng=None):
+        """Frames (F, H, 2W) for poses pos (F, 3), rot (F, 3, 3).
+
+        noise is the standard deviation of Gaussian pixel noise in grey
+        levels.
+        """
+        points = self.points(pos, rot)
+        xL, xR, y = project(self.camera, points)
+        depth = (points - self.camera.offset) @ self.camera.rotation[:, 2]
+        radius = self.markerRadius * self.camera.focalLength / depth
+
+        # pixel coordinates of both halves, rows counted from the bottom
+        row = (self.height - 1) - (self.height / 2 - y)
+        centers = np.concatenate(
+            [
+                np.stack([xL + self.width / 2, row], -1),
+                np.stack([xR + self.width / 2 + self.width, row], -1),
+            ],
+            axis=1,
+        )
+        radius = np.concatenate([radius, radius], axis=1)
+
+        # float32 in place throughout, noise is most of the work
+        frames = self._discs(centers, radius, len(pos))
+        frames *= 255
+        if noise > 0:
+            rng = rng or np.random.default_rng()
+            frames += noise * rng.standard_normal(frames.shape, dtype=np.float32)
+        np.rint(frames, out=frames)
+        np.clip(frames, 0, 255, out=frames)
+        return frames.astype(np.uint8)
+
+    def _discs(self, centers, radius, count):
+        # Every disc covers a small square patch; coverage is the distance of
+        # the pixel center to the rim, clamped to a pixel. All patches of all
+        # frames are scattered into the frames in one go.
+        h, w = self.height, 2 * self.width
+        size = 2 * int(np.ceil(radius.max())) + 3
+        offsets = np.arange(size) - size // 2
+
+        px = np.floor(centers[..., 0])[..., None] + offsets  # (F, K, P)
+        py = np.floor(centers[..., 1])[..., None] + offsets
+        dx = px - centers[..., 0, None]
+        dy = py - centers[..., 1, None]
+        dist = np.sqrt(dx[..., None, :] ** 2 + dy[..., :, None] ** 2)  # (F, K, P, P)
+        coverage = np.clip(radius[..., None, None] + 0.5 - dist, 0, 1)
+
+        frame = np.arange(count)[:, None, None, None]
+        px = px[..., None, :].astype(np.int64)
+        py = py[..., :, None].astype(np.int64)
+        inside = (px >= 0) & (px < w) & (py >= 0) & (py < h) & (coverage > 0)
+        index = (frame * h + py) * w + px
+
+        frames = np.zeros(count * h * w, dtype=np.float32)
+        np.maximum.at(frames, index[inside], coverage[inside].astype(np.float32))
+        return frames.reshape(count, h, w)
+
+    def header(self, seq, timestamp):
+        return FrameHeader(
+            seq,
+            timestamp,
+            2 * self.width,
+            self.height,
+            np.dtype(np.uint8),
+            1,
+            "bottom-left",
+            0,
+            -1,
+        )
+
+
+if __name__ == "__main__":
+    from recording import RecordingWriter
+
+    parser = argparse.ArgumentParser(description="Write a synthetic recording")
+    parser.add_argument("path")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--noise", type=float, default=0.0, help="grey levels")
+    args = parser.parse_args()
+
+    synthetic = SyntheticStereo()
+    writer = RecordingWriter(args.path)
+    rng = np.random.default_rng(0)
+    times = np.arange(args.frames) / args.fps
+    batch = params.RECORDING_CHUNK_FRAMES
+    for start in range(0, args.frames, batch):
+        t = times[start : start + batch]
+        pos, rot = trajectory(t)
+        frames = synthetic.render(pos, rot, args.noise, rng)
+        for i, frame in enumerate(frames):
+            writer.append(synthetic.header(start + i + 1, t[i]), frame)
+    writer.close()
+
+    pos, rot = trajectory(times)
+    # the instrument axis is z
+    np.savez(
+        os.path.join(args.path, "truth.npz"),
+        t=times,
+        pos=pos,
+        rot=rot,
+        dir=rot[..., :, 2],
+    )
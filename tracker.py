@@ -1,162 +1,325 @@
-import multiprocessing.connection as mpc
+from frame_stream import FrameStreamClient
+from frame_stream_async import AsyncFrameStreamClient
+from frame_format import toUint8
+from detectors import makeDetector
+from triangulation import triangulate, instrumentPose
+from correspondence import matchStereo
+from instruments import InstrumentRegistry
+import instrumentation
+import camera_model
 import params
 import glm
 import cv2
-from math import radians, tan, atan2
-from utils import centroid, findRotMat, dist2
+from collections import namedtuple
 import numpy as np
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# the default camera model, kept here under the old names
+fb_zoom = camera_model.default.fbZoom
+cam_fov = camera_model.default.fov
+img_width = camera_model.default.imgWidth
+img_height = camera_model.default.imgHeight
+full_img_width = camera_model.default.fullImgWidth
+full_img_height = camera_model.default.fullImgHeight
+
+camXDelta = camera_model.default.camXDelta
+camY = camera_model.default.camY
+camZ = camera_model.default.camZ
+
+camRotMat = camera_model.default.camRotMat
+
+focalLength = camera_model.default.focalLength
+
+NO_POINTS = np.zeros((0, 3))
+
+# pos and dir are those of the first instrument found, instruments holds the
+# InstrumentPose of every instrument found in the frame. seq counts processed
+# frames, timestamp is time.time() when the pose was found and frameTime when
+# the frame it was found in was rendered.
+TrackedPose = namedtuple(
+    "TrackedPose", ["pos", "dir", "seq", "timestamp", "instruments", "frameTime"]
+)
+
+# downscaled copy of a frame with the circles detected in it, scale is from
+# frame to img pixels
+Preview = namedtuple("Preview", ["img", "detected", "scale", "bottomUp", "timestamp"])
+
+
+def detectSide(detector, half, predicted=None, velocity=None):
+    """Finds the circles in one half of the stereo frame.
+
+    With a prediction only small windows around the predicted circles are
+    searched; if any of them doesn't contain exactly one circle the whole half
+    is searched instead. Returns the circles and whether the windows were used.
+    """
+    if predicted is not None:
+        circles = _detectRoi(detector, half, predicted, velocity)
+        if circles is not None:
+            return circles, True
+    return detector.detect(half), False
+
+
+def _detectRoi(detector, half, predicted, velocity):
+    h, w = half.shape[:2]
+    out = np.empty_like(predicted)
+    for i, (x, y, r) in enumerate(predicted):
+        vx, vy, _ = velocity[i]
+        size = r * params.ROI_RADIUS_SCALE + params.ROI_MARGIN
+        halfX, halfY = int(size + abs(vx)), int(size + abs(vy))
+
+        x0, x1 = max(int(x) - halfX, 0), min(int(x) + halfX + 1, w)
+        y0, y1 = max(int(y) - halfY, 0), min(int(y) + halfY + 1, h)
+        if x1 <= x0 or y1 <= y0:
+            return None
 
-fb_zoom = params.FB_ZOOM
-cam_fov = radians(params.CAM_FOV_DEGREES)
-img_width = params.CAM_SENSOR_WIDTH * fb_zoom
-img_height = params.CAM_SENSOR_HEIGHT * fb_zoom
-full_img_width = img_width * 2
-full_img_height = img_height
-
-camXDelta = params.CAM_X_DELTA
-camY = params.CAM_Y
-camZ = params.CAM_Z
-
-camPoseOrig = glm.vec3(0, 0, 1)
-camPose = glm.vec3(*params.CAM_POSE)
-camRotMat = findRotMat(camPoseOrig, camPose)
+        circles = detector.detect(half[y0:y1, x0:x1])
+        if len(circles) != 1:
+            return None
 
-focalLength = img_width / (2 * tan(cam_fov / 2))
+        out[i] = circles[0]
+        out[i, 0] += x0
+        out[i, 1] += y0
+    return out
 
 
 class Tracker:
-    def __init__(self):
-        self.client = None
-        self.last_img = None
+    def __init__(self, detector=None, camera=None, registry=None, pool=None):
+        self.camera = camera or camera_model.default
+        if params.STREAM_IO == "asyncio":
+            self.stream = AsyncFrameStreamClient()
+        else:
+            self.stream = FrameStreamClient()
+        self.detector = makeDetector(detector or params.TRACKER_DETECTOR)
+        self.registry = registry or InstrumentRegistry.fromParams()
+
+        # region of interest tracking, last circles per side in image pixels
+        self.roiTracking = params.TRACKER_ROI
+        self.roiCircles = None
+        self.roiVelocity = None
+
+        # the two halves of the stereo frame are processed concurrently
+        self.poolKind = pool or params.TRACKER_POOL
+        if self.poolKind == "thread":
+            self.pool = ThreadPoolExecutor(2)
+        elif self.poolKind == "process":
+            self.pool = ProcessPoolExecutor(2)
+        else:
+            self.pool = None
+
+        self.frameSeq = 0
+        self.latestPose = None
+        self.backgroundThread = None
+        self.backgroundRunning = False
+        self.frameTime = None
+
+        # preview frames are only made when asked for, see requestPreview()
+        self.previewWidth = None
+        self.preview = None
 
     def _isConnected(self):
-        return self.client is not None
+        return self.stream.isConnected()
 
     def _getImg(self):
-        if self.client == None:
-            try:
-                self.client = mpc.Client(("127.0.0.1", 5001), "AF_INET")
-            except ConnectionError:
-                return None
-
-        try:
-            arr = self.client.recv_bytes()
-        except EOFError:
-            self.client = None
+        with instrumentation.span("receive"):
+            arr = self.stream.recvFrame()
+        if arr is None:
             return None
 
-        arr = np.frombuffer(
-            arr,
-            (
-                np.float32,
-                (
-                    full_img_width,
-                    3,
-                ),
-            ),
-        )
+        header = self.stream.header
+        self.frameTime = header.timestamp
+        self.fitCamera(header.width, header.height)
+        with instrumentation.span("convert"):
+            return toUint8(arr)
+
+    def fitCamera(self, width, height):
+        # the frames say how big they are, the renderer may use another zoom
+        if width == self.camera.fullImgWidth and height == self.camera.fullImgHeight:
+            return
+        fbZoom = height // params.CAM_SENSOR_HEIGHT
+        self.camera = camera_model.StereoCameraModel(fbZoom)
+        self.roiCircles = None
+
+    def trackOnce(self):
+        """Processes one frame, returns a TrackedPose or None."""
+        points = self.getPoints()
+        self.frameSeq += 1
+        if points is None:
+            return None
 
-        img = np.round(arr * 255).astype(np.uint8)
-        self.last_img = img
-        return img
+        with instrumentation.span("identify"):
+            instruments = self.registry.identify(points)
+        if not instruments:
+            return None
 
-    def getInstrCoords(self):
+        first = instruments[0]
+        pose = TrackedPose(
+            glm.vec3(*first.pos),
+            glm.vec3(*first.dir),
+            self.frameSeq,
+            time.time(),
+            instruments,
+            self.frameTime,
+        )
+        self.latestPose = pose
+        return pose
+
+    def startBackground(self):
+        """Receives and processes frames on a worker thread.
+
+        Poll getLatestPose() for the result; it never blocks.
+        """
+        if self.backgroundThread is not None:
+            return
+
+        def run():
+            while self.backgroundRunning:
+                pose = self.trackOnce()
+                if pose is None and not self._isConnected():
+                    # don't spin on a refused connection
+                    time.sleep(0.1)
+
+        self.backgroundRunning = True
+        self.backgroundThread = threading.Thread(target=run, daemon=True)
+        self.backgroundThread.start()
+
+    def stopBackground(self):
+        if self.backgroundThread is None:
+            return
+        self.backgroundRunning = False
+        self.backgroundThread.join(timeout=1.0)
+        self.backgroundThread = None
+
+    def isBackground(self):
+        return self.backgroundThread is not None
+
+    def getLatestPose(self):
+        return self.latestPose
+
+    def _predictCircles(self):
+        if not self.roiTracking or self.roiCircles is None:
+            return [None, None]
+        return [c + v for c, v in zip(self.roiCircles, self.roiVelocity)]
+
+    def _detect(self, gray):
+        predicted = self._predictCircles()
+        w = self.camera.imgWidth
+        halves = [gray[:, :w], gray[:, w:]]
+        velocity = self.roiVelocity or [None, None]
+
+        if self.pool is None:
+            results = [
+                detectSide(self.detector, *args)
+                for args in zip(halves, predicted, velocity)
+            ]
+        else:
+            if self.poolKind == "process":
+                # views into the stream can't be pickled
+                halves = [np.ascontiguousarray(h) for h in halves]
+            futures = [
+                self.pool.submit(detectSide, self.detector, *args)
+                for args in zip(halves, predicted, velocity)
+            ]
+            results = [f.result() for f in futures]
+
+        detected = [circles for circles, _ in results]
+        roiHits = [roiHit for _, roiHit in results]
+        self._updateRoiState(detected, roiHits)
+        return detected
+
+    def _updateRoiState(self, detected, roiHits):
+        circlesL, circlesR = detected
+        if len(circlesL) == 0 or len(circlesL) != len(circlesR):
+            self.roiCircles = None
+            return
+
+        velocity = []
+        for i, circles in enumerate(detected):
+            if roiHits[i]:
+                # windows keep the marker order, so the motion is known
+                v = circles - self.roiCircles[i]  # type: ignore
+                v[:, 2] = 0
+            else:
+                v = np.zeros_like(circles)
+            velocity.append(v)
+
+        self.roiVelocity = velocity
+        self.roiCircles = [circlesL.copy(), circlesR.copy()]
+
+    def close(self):
+        self.stopBackground()
+        self.stream.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _toCentered(self, circles, bottomUp):
+        pts = circles[:, :2].astype(np.float64)
+        if bottomUp:
+            pts[:, 1] = (self.camera.imgHeight - 1) - pts[:, 1]
+
+        # make (0,0) origin and flip y axis
+        pts[:, 0] = pts[:, 0] - (self.camera.imgWidth / 2)
+        pts[:, 1] = (self.camera.imgHeight / 2) - pts[:, 1]
+        return pts
+
+    def requestPreview(self, width):
+        """Asks for a Preview of the next frame, downscaled to width."""
+        self.previewWidth = width
+
+    def _takePreview(self, gray, detected, bottomUp):
+        width = self.previewWidth
+        self.previewWidth = None
+        scale = width / gray.shape[1]
+        height = int(round(gray.shape[0] * scale))
+        small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+        circles = [sideCircles.copy() for sideCircles in detected]
+        self.preview = Preview(small, circles, scale, bottomUp, time.time())
+
+    def getPoints(self):
+        """Triangulates the markers in the next frame.
+
+        Returns an (N, 3) array of world points, or None without a frame.
+        """
         img = self._getImg()
         if img is None:
-            return None, None
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Blur using 3 * 3 kernel.
-        # gray = cv2.blur(gray, (3, 3))
-        gray = cv2.GaussianBlur(gray, (3, 3), 2)
-
-        # Apply Hough transform on the blurred image.
-        detected_circles = cv2.HoughCircles(
-            gray,
-            cv2.HOUGH_GRADIENT,
-            1,
-            30,
-            param1=50,
-            param2=20,
-            minRadius=0,
-            maxRadius=0,
-        )
-
-        # Process circles that are detected.
-        if detected_circles is not None:
-
-            circlesL = []
-            circlesR = []
-
-            for pt in detected_circles[0, :]:
-                a, b, r = pt[0], pt[1], pt[2]
-
-                x, y = a, b
-                isRight = False
-                if x > img_width:
-                    x -= img_width
-                    isRight = True
-
-                # make (0,0) origin and flip y axis
-                x = x - (img_width / 2)
-                y = (img_height / 2) - y
-
-                if isRight:
-                    circlesR.append((x, y))
-                else:
-                    circlesL.append((x, y))
-
-                # Convert the circle parameters a, b and r to integers.
-                (a, b, r) = np.uint16(np.around((a, b, r)))
-
-                # Draw the circumference of the circle.
-                cv2.circle(img, (a, b), r, (0, 255, 0), 2)
-
-                # Draw a small circle (of radius 1) to show the center.
-                cv2.circle(img, (a, b), 1, (0, 0, 255), 3)
-
-            circlesLC = centroid(circlesL)
-            circlesRC = centroid(circlesL)
-
-            def angleFromOrigin(p, origin):
-                x, y = p[0] - origin[0], p[1] - origin[1]
-                return atan2(y, x)
-
-            # sort by angle to find corresponding points
-            circlesL.sort(key=lambda p: angleFromOrigin(p, circlesLC))
-            circlesR.sort(key=lambda p: angleFromOrigin(p, circlesRC))
+            return None
 
-            points = []
+        # the frame is not flipped on the way, rows may count from the bottom
+        return self.findPoints(img, self.stream.isBottomUp())
 
-            for i, (pL, pR) in enumerate(zip(circlesL, circlesR)):
-                xDiff = abs(pL[0] - pR[0])
-                x = camXDelta * (pL[0] + pR[0]) / (2 * xDiff)
-                y = camXDelta * (pL[1]) / xDiff
-                z = camXDelta * focalLength / xDiff
+    def findPoints(self, img, bottomUp):
+        """Triangulates the markers in a uint8 stereo frame, (N, 3)."""
+        if img.ndim == 3:
+            with instrumentation.span("convert"):
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = img
 
-                vec = glm.vec4(x, y, z, 0)
-                vec = camRotMat * vec
-                points.append((vec.x, vec.y + camY, vec.z + camZ))
+        with instrumentation.span("detect"):
+            detected = self._detect(gray)
 
-            if len(points) == 3:
-                c = centroid(points)
+        if self.previewWidth is not None:
+            self._takePreview(gray, detected, bottomUp)
 
-                dists = [dist2(p, c) for p in points]
-                points_dists = list(zip(points, dists))
+        # Process circles that are detected.
+        if len(detected[0]) == 0 or len(detected[1]) == 0:
+            return NO_POINTS
 
-                points_dists.sort(key=lambda pt_dist: pt_dist[1])
-                top, _ = points_dists[0]
-                a, b = points_dists[1][0], points_dists[2][0]
-                m = centroid([a, b])
+        circlesL = self._toCentered(detected[0], bottomUp)
+        circlesR = self._toCentered(detected[1], bottomUp)
 
-                m = glm.vec3(*m)
-                top = glm.vec3(*top)
-                instrDir = glm.normalize(top - m)
-                # instrDirOrig = glm.vec3(0, 0, 1)
+        with instrumentation.span("match"):
+            idxL, idxR = matchStereo(self.camera, circlesL, circlesR)
+        with instrumentation.span("triangulate"):
+            return triangulate(self.camera, circlesL[idxL], circlesR[idxR])
 
-                instrPos = glm.vec3(*c)
+    def getInstrCoords(self):
+        points = self.getPoints()
 
-                return instrPos, instrDir
+        if points is not None and len(points) == 3:
+            instrPos, instrDir = instrumentPose(points)
+            return glm.vec3(*instrPos), glm.vec3(*instrDir)
 
         return None, None
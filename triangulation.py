@@ -0,0 +1,90 @@
+import numpy as np
+from functools import lru_cache
+
+# Batched stereo triangulation and instrument pose. Everything works on
+# arrays with arbitrary leading dimensions, so a single frame (N, 2) and a
+# stack of frames (F, N, 2) go through the same code. A single frame with
+# a few markers, the live tracker's case, is cheaper in plain Python than
+# the fixed cost of the NumPy calls and takes a scalar path.
+
+# up to this many markers a single frame is triangulated in plain Python
+SCALAR_MAX_POINTS = 8
+
+
+@lru_cache(maxsize=None)
+def _terms(camera):
+    # camera frame point = scale * ((xL + xR) / 2, yL, f), rotated into the
+    # world; fold the rotation into one matrix per image and a constant
+    rotT = camera.rotation.T
+    termL = np.array([[0.5, 0, 0], [0, 1, 0]]) @ rotT
+    termR = np.array([[0.5, 0, 0], [0, 0, 0]]) @ rotT
+    termF = camera.focalLength * rotT[2]
+    return termL, termR, termF
+
+
+@lru_cache(maxsize=None)
+def _scalarTerms(camera):
+    return camera.rotation.tolist(), camera.offset.tolist()
+
+
+def _triangulateScalar(camera, ptsL, ptsR):
+    (r0, r1, r2), (o0, o1, o2) = _scalarTerms(camera)
+    delta, f = camera.camXDelta, camera.focalLength
+    out = []
+    for (xL, yL), (xR, _) in zip(ptsL.tolist(), ptsR.tolist()):
+        scale = delta / abs(xL - xR)
+        x, y, z = 0.5 * (xL + xR) * scale, yL * scale, f * scale
+        out.append(
+            [
+                r0[0] * x + r0[1] * y + r0[2] * z + o0,
+                r1[0] * x + r1[1] * y + r1[2] * z + o1,
+                r2[0] * x + r2[1] * y + r2[2] * z + o2,
+            ]
+        )
+    return np.array(out, dtype=np.float64).reshape(-1, 3)
+
+
+def triangulate(camera, ptsL, ptsR):
+    """Turns matched image points into world points.
+
+    ptsL, ptsR are (..., N, 2) in centered image coordinates with y up, as
+    produced by the tracker. Returns (..., N, 3).
+    """
+    ptsL = np.asarray(ptsL, dtype=np.float64)
+    ptsR = np.asarray(ptsR, dtype=np.float64)
+    if ptsL.ndim == 2 and len(ptsL) <= SCALAR_MAX_POINTS:
+        return _triangulateScalar(camera, ptsL, ptsR)
+    termL, termR, termF = _terms(camera)
+
+    scale = camera.camXDelta / np.abs(ptsL[..., 0] - ptsR[..., 0])
+    return scale[..., None] * (ptsL @ termL + ptsR @ termR + termF) + camera.offset
+
+
+def instrumentPose(points):
+    """Position and direction of a three marker instrument.
+
+    points is (..., 3, 3). The position is the centroid of the markers, the
+    direction points from the middle of the two outer markers to the one
+    closest to the centroid. Returns pos (..., 3) and dir (..., 3).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 2:
+        return _instrumentPoseScalar(points)
+    c = points.sum(axis=-2) / 3
+
+    diff = points - c[..., None, :]
+    top = (diff * diff).sum(axis=-1).argmin(axis=-1)
+    d = np.take_along_axis(diff, top[..., None, None], axis=-2)[..., 0, :]
+
+    # the middle of the other two is 3c/2 - top/2, so top - middle is just
+    # a multiple of top - c
+    return c, d / np.sqrt((d * d).sum(axis=-1, keepdims=True))
+
+
+def _instrumentPoseScalar(points):
+    pts = points.tolist()
+    c = [(pts[0][i] + pts[1][i] + pts[2][i]) / 3 for i in range(3)]
+    diffs = [[p[i] - c[i] for i in range(3)] for p in pts]
+    d = min(diffs, key=lambda v: v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    norm = (d[0] * d[0] + d[1] * d[1] + d[2] * d[2]) ** 0.5
+    return np.array(c), np.array(d) / norm
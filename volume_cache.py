@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import params
+
+# GPU ready volumes on disk, so a start doesn't decompress and convert the
+# CT again. An entry is
+#   <key>.bin    the texture bytes, x fastest as glTexImage3D takes them
+#   <key>.json   dims, texture shape, format and shader scale
+# where key hashes the source file's content together with every parameter
+# of the conversion; when either changes the key does and the entry is
+# rebuilt. index.json remembers the content hash per path, size and mtime,
+# so an unchanged source isn't read just to hash it.
+#
+# Bump CACHE_VERSION when the conversion itself changes.
+
+CACHE_VERSION = 1
+
+# content hashes computed in this process, by (path, size, mtime)
+_hashes = {}
+
+
+def _path(name):
+    return os.path.join(params.VOLUME_CACHE_DIR, name)
+
+
+def _readIndex():
+    try:
+        with open(_path("index.json"), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _replace(path, mode, write):
+    # Written aside and moved, so readers never see half a file. The name
+    # aside is this writer's own, apps filling the cache at once don't
+    # move each other's files.
+    fd, tmp = tempfile.mkstemp(dir=params.VOLUME_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as file:
+            write(file)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _writeJson(path, data):
+    _replace(path, "w", lambda file: json.dump(data, file, indent=1))
+
+
+def contentHash(source):
+    stat = os.stat(source)
+    path = os.path.abspath(source)
+    known = (path, stat.st_size, stat.st_mtime_ns)
+    if known in _hashes:
+        return _hashes[known]
+
+    entry = _readIndex().get(path)
+    if entry and (entry["size"], entry["mtime"]) == known[1:]:
+        _hashes[known] = entry["sha256"]
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(source, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    _hashes[known] = digest.hexdigest()
+    return _hashes[known]
+
+
+def cacheKey(source):
+    conversion = {
+        "version": CACHE_VERSION,
+        "format": params.VOLUME_TEXTURE_FORMAT,
+        "padding": params.VOLUME_POT_PADDING,
+    }
+    digest = hashlib.sha256(contentHash(source).encode())
+    digest.update(json.dumps(conversion, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def load(source):
+    """(tex, meta) from the cache, tex memory mapped, or None on a miss."""
+    if not params.VOLUME_CACHE:
+        return None
+    key = cacheKey(source)
+    try:
+        with open(_path(key + ".json"), "r") as file:
+            meta = json.load(file)
+        tex = np.memmap(
+            _path(key + ".bin"),
+            dtype=np.dtype(meta["dtype"]),
+            mode="r",
+            shape=tuple(meta["shape"]),
+            order="F",
+        )
+    except (OSError, ValueError, KeyError):
+        return None
+    return tex, meta
+
+
+def store(source, tex, meta):
+    """Adds tex, a Fortran ordered texture buffer, with meta, a JSON-able
+    dict, and drops the entry the source had before. Best effort, a cache
+    that can't be written is reported and left as it is."""
+    if not params.VOLUME_CACHE:
+        return
+    try:
+        _store(source, tex, meta)
+    except OSError as e:
+        print("volume cache not written:", e)
+
+
+def _store(source, tex, meta):
+    os.makedirs(params.VOLUME_CACHE_DIR, exist_ok=True)
+    key = cacheKey(source)
+
+    _replace(_path(key + ".bin"), "wb", tex.ravel(order="F").tofile)
+    # the sidecar goes last, an entry without it is never read
+    meta = dict(meta, dtype=tex.dtype.str, shape=list(tex.shape))
+    _writeJson(_path(key + ".json"), meta)
+
+    stat = os.stat(source)
+    index = _readIndex()
+    path = os.path.abspath(source)
+    old = index.get(path, {}).get("key")
+    index[path] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": contentHash(source),
+        "key": key,
+    }
+    _writeJson(_path("index.json"), index)
+
+    if old is not None and old != key:
+        for name in [old + ".bin", old + ".json"]:
+            try:
+                os.remove(_path(name))
+            except OSError:
+                pass
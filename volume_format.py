@@ -0,0 +1,90 @@
+from collections import namedtuple
+import math
+import numpy as np
+import OpenGL.GL as gl
+import params
+
+# Single channel 3D texture formats for volumes. Integer texels are
+# normalized by GL when sampled, value / norm, and VolumeShader's scale
+# uniforms turn them back into stored values and then HU.
+VolumeFormat = namedtuple(
+    "VolumeFormat", ["name", "dtype", "internalFormat", "glType", "norm"]
+)
+
+R8 = VolumeFormat("r8", np.dtype(np.uint8), gl.GL_R8, gl.GL_UNSIGNED_BYTE, 255.0)
+R8_SNORM = VolumeFormat(
+    "r8_snorm", np.dtype(np.int8), gl.GL_R8_SNORM, gl.GL_BYTE, 127.0
+)
+R16 = VolumeFormat("r16", np.dtype(np.uint16), gl.GL_R16, gl.GL_UNSIGNED_SHORT, 65535.0)
+# rather than R16I, which would need an isampler3D and can't be filtered
+R16_SNORM = VolumeFormat(
+    "r16_snorm", np.dtype(np.int16), gl.GL_R16_SNORM, gl.GL_SHORT, 32767.0
+)
+R16F = VolumeFormat("r16f", np.dtype(np.float16), gl.GL_R16F, gl.GL_HALF_FLOAT, 1.0)
+R32F = VolumeFormat("r32f", np.dtype(np.float32), gl.GL_R32F, gl.GL_FLOAT, 1.0)
+
+FORMATS = {f.name: f for f in [R8, R8_SNORM, R16, R16_SNORM, R16F, R32F]}
+
+HALF_MAX = 65504.0
+
+
+def chooseFormat(dtype, lo, hi):
+    """Smallest format holding stored values of dtype in [lo, hi].
+
+    Returns the format and the offset subtracted from the values to make
+    them fit, params.VOLUME_TEXTURE_FORMAT can force a format.
+    """
+    if params.VOLUME_TEXTURE_FORMAT != "auto":
+        return FORMATS[params.VOLUME_TEXTURE_FORMAT], 0
+
+    if np.dtype(dtype).kind not in "iu":
+        if max(abs(lo), abs(hi)) <= HALF_MAX:
+            return R16F, 0
+        return R32F, 0
+
+    lo, hi = int(lo), int(hi)
+    if lo >= 0 and hi <= 255:
+        return R8, 0
+    if lo >= -127 and hi <= 127:
+        return R8_SNORM, 0
+    if hi - lo <= 255:
+        return R8, lo
+    # -32768 is read back as -32767, so it is shifted instead
+    if lo >= -32767 and hi <= 32767:
+        return R16_SNORM, 0
+    if lo >= 0 and hi <= 65535:
+        return R16, 0
+    if hi - lo <= 65535:
+        return R16, lo
+    return R32F, 0
+
+
+def volumeShape(dims):
+    """Texture size for a volume of dims. Padded to powers of two only with
+    params.VOLUME_POT_PADDING, for drivers without NPOT textures."""
+    if not params.VOLUME_POT_PADDING:
+        return list(dims)
+    return [2 ** math.ceil(math.log2(n)) for n in dims]
+
+
+def packVolume(raw, shape, fmt, offset=0):
+    """raw in a zeroed Fortran ordered array of shape and the format's dtype,
+    in one pass without temporaries."""
+    tex = np.zeros(shape, dtype=fmt.dtype, order="F")
+    region = tex[tuple(slice(0, n) for n in raw.shape)]
+    if offset:
+        # int64 per buffered block, so the shift can't overflow
+        np.subtract(raw, offset, out=region, dtype=np.int64, casting="unsafe")
+    else:
+        region[...] = raw
+    return tex
+
+
+def scaleUniforms(fmt, offset, slope=1.0, inter=0.0):
+    """(slope, inter) for VolumeShader.setScale(), from sampled texels to
+    HU given the stored to HU slope and inter."""
+    return fmt.norm * slope, offset * slope + inter
+
+
+def textureBytes(fmt, shape):
+    return int(np.prod(shape)) * fmt.dtype.itemsize
@@ -5,7 +5,29 @@ import ctypes
 from collections import namedtuple
 from pathlib import Path
 import nibabel as nib
-import math
+import sys
+import threading
+import time
+import params
+from volume_format import (
+    FORMATS,
+    chooseFormat,
+    packVolume,
+    scaleUniforms,
+    volumeShape,
+)
+import volume_cache
+
+
+def peakMemoryMB():
+    try:
+        import resource
+    except ImportError:
+        # not on Windows
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
 
 
 class VolumeNiiMesh:
@@ -20,36 +42,91 @@ class VolumeNiiMesh:
         self.dims = []
         self.dims2 = []
 
-        self._load_data()
-
-    def _load_data(self):
         vs = [(-2, 2, 0), (2, 2, 0), (2, -2, 0), (-2, -2, 0)]
         self.vertices = np.array(vs, dtype=np.float32)
         fs = [(0, 1, 3), (3, 1, 2), (4, 5, 7), (7, 5, 6)]
         self.faces = np.array(fs, dtype=(np.uint32))
 
+        # The volume is decoded on a worker thread and uploaded by update()
+        # a few slices per frame; until then draw() leaves it out.
+        self.tex3d = None
+        self.texo = None
+        self.loaded = threading.Event()
+        self.loadError = None
+        self.allocated = False
+        self.uploadedSlices = 0
+        self.sliceSeconds = None
+
+        if params.VOLUME_BACKGROUND_LOAD:
+            threading.Thread(target=self._load_data, daemon=True).start()
+        else:
+            self._load_data()
+
+    def _load_data(self):
+        try:
+            self._load_volume()
+        except Exception as e:
+            # raised again on the GL thread by update()
+            self.loadError = e
+        self.loaded.set()
+
+    def _load_volume(self):
+        cached = volume_cache.load(self.filename)
+        if cached is None:
+            self.tex3d, meta = self._convert()
+            volume_cache.store(self.filename, self.tex3d, meta)
+        else:
+            self.tex3d, meta = cached
+            print("from cache", self.tex3d.filename)
+
+        self.dims = meta["dims"]
+        self.dims2 = list(self.tex3d.shape)
+        self.format = FORMATS[meta["format"]]
+        self.scaleSlope, self.scaleInter = meta["scale"]
+
+        print("in", tuple(self.dims), "stored", meta["stored"])
+        print("in padded", self.tex3d.shape)
+        print(
+            "format",
+            self.format.name,
+            "offset",
+            meta["offset"],
+            "slope",
+            meta["slope"],
+            "inter",
+            meta["inter"],
+        )
+        print("peak memory {:.0f} MB".format(peakMemoryMB()))
+
+    def _convert(self):
         img = nib.load(self.filename)
         # print(img.metadata)
-        data = img.get_fdata()
-        assert len(data.shape) == 3, "Not 3D data"
+        proxy = img.dataobj
+        assert len(proxy.shape) == 3, "Not 3D data"
+        dims = list(proxy.shape)
 
-        def next_power_of_two(x):
-            return 2 ** (math.ceil(math.log(x, 2)))
+        # The values as stored, usually int16. The scaling to HU is done in
+        # the shader instead of expanding the whole volume to float64.
+        raw = proxy.get_unscaled()
+        # the smallest texture format for the range of the values
+        fmt, offset = chooseFormat(raw.dtype, raw.min(), raw.max())
 
-        pads = []
-        for s in data.shape:
-            next_two_power = next_power_of_two(s)
-            pad = next_two_power - s
-            pads.append((0, pad))
+        # GL reads x fastest, so the one texture buffer is in Fortran order
+        # and filled in a single copy, which also fixes the byte order
+        tex = packVolume(raw, volumeShape(dims), fmt, offset)
+        del raw
 
-            self.dims.append(s)
-            self.dims2.append(next_two_power)
-
-        padded = np.float32(np.pad(data, pads))
-        print("in", data.shape)
-        print("in padded", padded.shape)
-        print("dtype", padded.dtype)
-        self.tex3d = padded.flatten("F")
+        slope, inter = float(proxy.slope), float(proxy.inter)
+        meta = {
+            "dims": dims,
+            "stored": proxy.dtype.str,
+            "format": fmt.name,
+            "offset": int(offset),
+            "slope": slope,
+            "inter": inter,
+            "scale": scaleUniforms(fmt, offset, slope, inter),
+        }
+        return tex, meta
 
     def uploadMeshData(self):
         # create VBO, upload data
@@ -110,20 +187,91 @@ class VolumeNiiMesh:
         )
         gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
         gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glBindTexture(gl.GL_TEXTURE_3D, 0)
+
+        if not params.VOLUME_BACKGROUND_LOAD:
+            self.update(budget=None)
+
+    def update(self, budget=-1):
+        """Uploads Z slabs of the volume once it is decoded, for at most
+        budget seconds, params.VOLUME_UPLOAD_BUDGET_MS by default and all of
+        it with None. Call once per frame on the GL thread."""
+        if self.isReady() or not self.loaded.is_set():
+            return
+        if self.loadError is not None:
+            raise self.loadError
+        if budget == -1:
+            budget = params.VOLUME_UPLOAD_BUDGET_MS / 1000
+
+        start = time.perf_counter()
+        gl.glBindTexture(gl.GL_TEXTURE_3D, self.texo)
+        # rows of 1 and 2 byte texels needn't be 4 byte aligned
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        width, height, depth = self.dims2
+
+        if not self.allocated:
+            gl.glTexImage3D(
+                gl.GL_TEXTURE_3D,
+                0,
+                self.format.internalFormat,
+                width,
+                height,
+                depth,
+                0,
+                gl.GL_RED,
+                self.format.glType,
+                None,
+            )
+            self.allocated = True
+
+        while self.uploadedSlices < depth:
+            if budget is None:
+                count = depth
+            else:
+                left = budget - (time.perf_counter() - start)
+                if left <= 0:
+                    break
+                # as many slices as the measured cost leaves room for
+                count = int(left / self.sliceSeconds) if self.sliceSeconds else 1
+                count = max(count, 1)
+            z0 = self.uploadedSlices
+            z1 = min(z0 + count, depth)
+
+            sliceStart = time.perf_counter()
+            # slices of the Fortran ordered buffer are contiguous, no copy
+            gl.glTexSubImage3D(
+                gl.GL_TEXTURE_3D,
+                0,
+                0,
+                0,
+                z0,
+                width,
+                height,
+                z1 - z0,
+                gl.GL_RED,
+                self.format.glType,
+                self.tex3d[:, :, z0:z1].ravel(order="F"),  # type: ignore
+            )
+            perSlice = (time.perf_counter() - sliceStart) / (z1 - z0)
+            if self.sliceSeconds is None:
+                self.sliceSeconds = perSlice
+            else:
+                self.sliceSeconds = 0.7 * self.sliceSeconds + 0.3 * perSlice
+            self.uploadedSlices = z1
 
-        gl.glTexImage3D(
-            gl.GL_TEXTURE_3D,
-            0,
-            gl.GL_RGBA32F,
-            self.dims2[0],
-            self.dims2[1],
-            self.dims2[2],
-            0,
-            gl.GL_RED,
-            gl.GL_FLOAT,
-            self.tex3d,
-        )
         gl.glBindTexture(gl.GL_TEXTURE_3D, 0)
+        if self.isReady():
+            # all on the GPU, the host copy or mapping can go
+            self.tex3d = None
+
+    def isReady(self):
+        return self.allocated and self.uploadedSlices == self.dims2[2]
+
+    def progress(self):
+        """Loaded fraction, decoding counts as the first half."""
+        if not self.loaded.is_set() or self.loadError is not None:
+            return 0.0
+        return 0.5 + 0.5 * self.uploadedSlices / self.dims2[2]
 
     def moveTo(self, x, y, z):
         self.position = glm.vec3(x, y, z)
@@ -161,6 +309,8 @@ class VolumeNiiMesh:
         self.scale = glm.vec3(x, y, z)
 
     def draw(self):
+        if not self.isReady():
+            return
         self.shader.use()
         matT = self.getTranslationMat()
         matR = self.getRotationMat()
@@ -169,6 +319,7 @@ class VolumeNiiMesh:
         self.shader.setModelMatrix(modelMat)
         self.shader.setTexIdx(0)
         self.shader.setDims(*self.dims, *self.dims2)
+        self.shader.setScale(self.scaleSlope, self.scaleInter)
 
         gl.glBindVertexArray(self.vao)
         gl.glActiveTexture(gl.GL_TEXTURE0)
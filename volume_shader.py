@@ -27,6 +27,8 @@ class VolumeShader(Shader):
         uniform sampler3D tex;
         uniform float xMax, yMax, zMax;
         uniform float xMax2, yMax2, zMax2;
+        // stored texels to HU
+        uniform float scaleSlope = 1.0, scaleInter = 0.0;
 
         in vec3 f_pos;
 
@@ -65,7 +67,7 @@ class VolumeShader(Shader):
                 float z = g(rv.z, zMax, zMax2);
                 vec3 texCoord = vec3(x,y,z);
                 
-                float hu = texture(tex, texCoord).x/1000;
+                float hu = (texture(tex, texCoord).x*scaleSlope + scaleInter)/1000;
 
                 float lim = 0.01;
                 if(col < lim && hu > lim) {
@@ -85,6 +87,7 @@ class VolumeShader(Shader):
         super().compile()
         # some drivers don't respect default uniform values set in shader
         self.setModelMatrix(glm.identity(glm.mat4))
+        self.setScale(1.0, 0.0)
 
     def setModelMatrix(self, mat4):
         self._setMat4("model", mat4)
@@ -107,5 +110,9 @@ class VolumeShader(Shader):
         self._setFloat("yMax2", yMax2)
         self._setFloat("zMax2", zMax2)
 
+    def setScale(self, slope, inter):
+        self._setFloat("scaleSlope", slope)
+        self._setFloat("scaleInter", inter)
+
     def getPositionAttribLoc(self):
         return self._getAttribLocation("position")
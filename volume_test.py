@@ -4,6 +4,7 @@ import glm
 import ctypes
 from collections import namedtuple
 from pathlib import Path
+from volume_format import chooseFormat, packVolume, scaleUniforms, volumeShape
 
 
 class VolumeTestMesh:
@@ -24,7 +25,8 @@ class VolumeTestMesh:
         fs = [(0, 1, 3), (3, 1, 2), (4, 5, 7), (7, 5, 6)]
         self.faces = np.array(fs, dtype=(np.uint32))
 
-        self.tex3d = np.zeros((16, 16, 16), dtype=np.uint8)
+        self.dims2 = volumeShape([self.xMax, self.yMax, self.zMax])
+        shell = np.zeros(self.dims2, dtype=np.uint8)
 
         for x in range(10):
             for y in range(10):
@@ -38,7 +40,11 @@ class VolumeTestMesh:
                         )
                         <= 1
                     ):
-                        self.tex3d[x, y, z] = 255
+                        shell[x, y, z] = 255
+
+        # in whatever format VOLUME_TEXTURE_FORMAT asks for
+        self.format, self.offset = chooseFormat(shell.dtype, 0, 255)
+        self.tex3d = packVolume(shell, self.dims2, self.format, self.offset)
 
     def uploadMeshData(self):
         # create VBO, upload data
@@ -100,20 +106,31 @@ class VolumeTestMesh:
         gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
         gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
 
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
         gl.glTexImage3D(
             gl.GL_TEXTURE_3D,
             0,
-            gl.GL_RGBA32F,
-            16,
-            16,
-            16,
+            self.format.internalFormat,
+            *self.dims2,
             0,
             gl.GL_RED,
-            gl.GL_UNSIGNED_BYTE,
-            self.tex3d,
+            self.format.glType,
+            # z fastest, as the test volume has always been laid out
+            np.ascontiguousarray(self.tex3d),
         )
         gl.glBindTexture(gl.GL_TEXTURE_3D, 0)
 
+    # built and uploaded at once, for the apps that load VolumeNiiMesh in
+    # the background
+    def update(self):
+        pass
+
+    def isReady(self):
+        return True
+
+    def progress(self):
+        return 1.0
+
     def moveTo(self, x, y, z):
         self.position = glm.vec3(x, y, z)
 
@@ -148,7 +165,9 @@ class VolumeTestMesh:
         modelMat = matT * matR
         self.shader.setModelMatrix(modelMat)
         self.shader.setTexIdx(0)
-        self.shader.setDims(self.xMax, self.yMax, self.zMax, 16, 16, 16)
+        self.shader.setDims(self.xMax, self.yMax, self.zMax, *self.dims2)
+        # the shell is 255 in stored units, there is no HU scaling
+        self.shader.setScale(*scaleUniforms(self.format, self.offset))
 
         gl.glBindVertexArray(self.vao)
         gl.glActiveTexture(gl.GL_TEXTURE0)
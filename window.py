@@ -3,6 +3,7 @@ import imgui
 from imgui.integrations.glfw import GlfwRenderer
 import params
 import time
+import instrumentation
 
 
 class Window:
@@ -162,6 +163,7 @@ class Window:
             delta = now - last
             last = now
             print(f"{last - start}, {1 / delta}, {delta}", file=f)
+            instrumentation.record("frame", delta)
             glfw.poll_events()
             self.imgui_impl.process_inputs()
             imgui.new_frame()